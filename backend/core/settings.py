@@ -189,20 +189,128 @@ CSRF_TRUSTED_ORIGINS = [
 # CELERY / REDIS
 # --------------------------------------------------
 
-CELERY_BROKER_URL = "redis://localhost:6379/0"
-CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
+REDIS_URL = config("REDIS_URL", default="redis://localhost:6379/0")
+
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 
 CELERY_BEAT_SCHEDULE = {
     "verificar-turnos-cada-1min": {
         "task": "src.tasks.verificar_turnos",
         "schedule": 60.0,
+        # un tick que no arrancó antes del siguiente se descarta en la cola
+        "options": {"expires": 55},
     },
     "recordatorios-diarios": {
         "task": "src.tasks.programar_recordatorios",
-        "schedule": crontab(hour=6),
+        "schedule": crontab(hour=6, minute=0),
+    },
+    "podar-eventos-procesados": {
+        "task": "src.tasks.podar_eventos_procesados",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "sincronizar-efectores": {
+        "task": "src.tasks.sincronizar_efectores",
+        "schedule": crontab(hour=4, minute=0),
+    },
+    "despachar-programados": {
+        "task": "src.tasks.despachar_programados",
+        "schedule": 5.0,
+        "options": {"expires": 4},
+    },
+    "despachar-bandeja": {
+        "task": "src.tasks.despachar_bandeja",
+        "schedule": 30.0,
+        "options": {"expires": 25},
+    },
+    "drenar-reenvios": {
+        "task": "src.tasks.drenar_reenvios",
+        "schedule": 60.0,
+        "options": {"expires": 55},
+    },
+    "refrescar-estados-mensajes": {
+        "task": "src.tasks.refrescar_estados_mensajes",
+        "schedule": 60.0,
+        "options": {"expires": 55},
     },
 }
 
+# --------------------------------------------------
+# NOTIFICACIONES
+# --------------------------------------------------
+
+# lease del lock de verificar_turnos (se renueva en cada página)
+POLL_LOCK_LEASE = config("POLL_LOCK_LEASE", default=300, cast=int)
+# pasadas máximas por ejecución al absorber ticks salteados
+POLL_MAX_PASADAS = config("POLL_MAX_PASADAS", default=3, cast=int)
+# segundos que se releen antes de LastMod en cada pasada (el registro de eventos evita reprocesar)
+POLL_SOLAPAMIENTO = config("POLL_SOLAPAMIENTO", default=120, cast=int)
+# días que se conservan en evento_procesado
+EVENTOS_RETENCION_DIAS = config("EVENTOS_RETENCION_DIAS", default=7, cast=int)
+# segundos de vida de la caché de catálogo (efector/servicio/especialidad) por proceso
+CATALOGO_TTL = config("CATALOGO_TTL", default=600, cast=int)
+# segundos antes de volver a pedir la sincronización de un efector sin dirección local
+EFECTORES_REINTENTO_SEG = config("EFECTORES_REINTENTO_SEG", default=3600, cast=int)
+# segundos de vida de la caché de configuración de avisos (EfeSerEspPlantilla) por proceso
+CONFIG_NOTIF_TTL = config("CONFIG_NOTIF_TTL", default=120, cast=int)
+# segundos entre consultas a Redis de la versión de esas cachés (demora máxima de una invalidación)
+CACHE_VERSION_SEG = config("CACHE_VERSION_SEG", default=5, cast=int)
+
+# cliente HTTP de la API de WhatsApp (src/utils/gateway.py)
+GATEWAY_POOL = config("GATEWAY_POOL", default=10, cast=int)
+GATEWAY_CONNECT_TIMEOUT = config("GATEWAY_CONNECT_TIMEOUT", default=3.05, cast=float)
+GATEWAY_READ_TIMEOUT = config("GATEWAY_READ_TIMEOUT", default=15, cast=float)
+GATEWAY_REINTENTOS = config("GATEWAY_REINTENTOS", default=3, cast=int)
+# factor de backoff exponencial y jitter máximo (segundos) entre reintentos
+GATEWAY_BACKOFF = config("GATEWAY_BACKOFF", default=0.5, cast=float)
+# requests en vuelo del cliente asyncio en envíos por lote
+GATEWAY_CONCURRENCIA = config("GATEWAY_CONCURRENCIA", default=20, cast=int)
+
+# mensajes por ejecución de refrescar_estados_mensajes
+ESTADOS_LOTE = config("ESTADOS_LOTE", default=200, cast=int)
+# horas desde el envío en las que se sigue consultando el estado de un mensaje
+ESTADOS_MAX_HORAS = config("ESTADOS_MAX_HORAS", default=72, cast=int)
+# minutos sin callback de ack antes de consultar el estado por polling
+ESTADOS_ESPERA_CALLBACK = config("ESTADOS_ESPERA_CALLBACK", default=15, cast=int)
+# segundos máximos de polling por corrida (el beat es cada 60)
+ESTADOS_PRESUPUESTO_SEG = config("ESTADOS_PRESUPUESTO_SEG", default=50, cast=int)
+
+# límite de envíos por sesión de WhatsApp (token bucket en Redis)
+WHATSAPP_SESION = config("WHATSAPP_SESION", default="1")
+LIMITE_TASA = config("LIMITE_TASA", default=1.0, cast=float)  # mensajes por segundo sostenidos
+LIMITE_RAFAGA = config("LIMITE_RAFAGA", default=10, cast=int)
+# segundos que un envío espera su turno antes de reprogramarse
+LIMITE_ESPERA_MAX = config("LIMITE_ESPERA_MAX", default=5, cast=float)
+
+# circuit breaker del gateway y cola de reenvío
+CIRCUITO_UMBRAL = config("CIRCUITO_UMBRAL", default=5, cast=int)
+CIRCUITO_VENTANA = config("CIRCUITO_VENTANA", default=60, cast=int)
+CIRCUITO_ABIERTO_SEG = config("CIRCUITO_ABIERTO_SEG", default=60, cast=int)
+REENVIO_MAX_INTENTOS = config("REENVIO_MAX_INTENTOS", default=10, cast=int)
+REENVIO_LOTE = config("REENVIO_LOTE", default=200, cast=int)
+
+# bandeja de salida (outbox): filas por reclamo y lease de una fila en envío (segundos)
+BANDEJA_LOTE = config("BANDEJA_LOTE", default=50, cast=int)
+BANDEJA_LEASE = config("BANDEJA_LEASE", default=120, cast=int)
+# envíos programados (recordatorios): filas por reclamo, lease (segundos) y
+# espera/intentos de respaldo mientras el número tiene un Flow abierto (el
+# cierre del Flow en listen.py los libera antes, ver src.utils.espera_flow)
+PROGRAMADOS_LOTE = config("PROGRAMADOS_LOTE", default=100, cast=int)
+PROGRAMADOS_LEASE = config("PROGRAMADOS_LEASE", default=120, cast=int)
+PROGRAMADOS_FLOW_ESPERA = config("PROGRAMADOS_FLOW_ESPERA", default=3600, cast=int)
+PROGRAMADOS_FLOW_REINTENTOS = config("PROGRAMADOS_FLOW_REINTENTOS", default=20, cast=int)
+# snapshots de detalles de recordatorios: vida extra (segundos) después del último envío programado
+SNAPSHOT_MARGEN = config("SNAPSHOT_MARGEN", default=2 * 24 * 3600, cast=int)
+# días que se recuerda un teléfono rechazado por el gateway (404/422)
+TELEFONO_TTL = config("TELEFONO_TTL", default=30, cast=int)
+
+# listas IN a Informix: por encima de esta cantidad de ids se usa una tabla temporal
+INFORMIX_IN_TEMP = config("INFORMIX_IN_TEMP", default=5000, cast=int)
+
+# modo simulación: los envíos van a un registro en Redis en lugar de API_WHATSAPP
+NOTIF_SIMULACION = config("NOTIF_SIMULACION", default=False, cast=bool)
+SIMULACION_MAX_REGISTROS = config("SIMULACION_MAX_REGISTROS", default=10000, cast=int)
+
 # --------------------------------------------------
 # MISC
 # --------------------------------------------------
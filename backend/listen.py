@@ -22,11 +22,16 @@ import django
 django.setup()
 
 from src.models import Flow, MsgFlowEnv, MsgFlowRec, Nodo, Turno, TurnoFlow
+from src.utils.estados import aplicar_acks
+from src.utils.espera_flow import liberar_flow
 
 # Config
 HOST = "127.0.0.1"
 PORT = int(config("LISTEN_PORT"))
 ENDPOINT = config("API_LISTEN")
+ENDPOINT_ACK = config("API_LISTEN_ACK", default=f"{ENDPOINT}/ack")
+ACK_FLUSH_SECONDS = float(config("ACK_FLUSH_SECONDS", default=1))
+ACK_LOTE = int(config("ACK_LOTE", default=500))
 MAX_BODY_BYTES = 1_000_000
 LOG_LEVEL = config("INTERNAL_SERVER_LOGLEVEL", default="INFO")
 
@@ -83,44 +88,37 @@ async def get_or_create_flow(pk:str, para: str, sesion: str) -> Flow:
 
 ARG_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
 
+def fecha_arg(fecha) -> datetime:
+    """Normaliza epoch (s/ms), ISO o datetime a datetime naive en hora ARG."""
+    if fecha is None:
+        return datetime.now(tz=ARG_TZ).replace(tzinfo=None)  # naive local ARG
+    # si viene epoch (int/float)
+    if isinstance(fecha, (int, float)):
+        # detectar segundos vs ms: si > 1e12 es ms
+        ts = int(fecha / 1000) if fecha > 1e12 else int(fecha)
+        dt_utc = datetime.fromtimestamp(ts, tz=ZoneInfo("UTC"))
+        dt_arg = dt_utc.astimezone(ARG_TZ)
+        return dt_arg.replace(tzinfo=None)
+    if isinstance(fecha, str):
+        # intentar parse iso; aceptar "2025-12-01T11:33:52" (sin tz)
+        try:
+            dt = datetime.fromisoformat(fecha)
+        except Exception:
+            # fallback: ahora en ARG
+            return datetime.now(tz=ARG_TZ).replace(tzinfo=None)
+        fecha = dt
+    if isinstance(fecha, datetime):
+        if fecha.tzinfo is None:
+            return fecha  # asumimos ya hora ARG naive
+        return fecha.astimezone(ARG_TZ).replace(tzinfo=None)
+    return datetime.now(tz=ARG_TZ).replace(tzinfo=None)
+
 async def set_flow_estado(pk, estado, fecha):
     def _set():
         f = Flow.objects.get(pk=pk)
         f.id_estado_id = estado
-
         # Determinar cierre como naive en hora ARG
-        if fecha is None:
-            cierre = datetime.now(tz=ARG_TZ).replace(tzinfo=None)  # naive local ARG
-        else:
-            # si viene epoch (int/float)
-            if isinstance(fecha, (int, float)):
-                # detectar segundos vs ms: si > 1e12 es ms
-                ts = int(fecha / 1000) if fecha > 1e12 else int(fecha)
-                dt_utc = datetime.fromtimestamp(ts, tz=ZoneInfo("UTC"))
-                dt_arg = dt_utc.astimezone(ARG_TZ)
-                cierre = dt_arg.replace(tzinfo=None)
-            elif isinstance(fecha, str):
-                # intentar parse iso; aceptar "2025-12-01T11:33:52" (sin tz)
-                try:
-                    dt = datetime.fromisoformat(fecha)
-                    # si es naive, asumimos que viene en ARG -> lo hacemos naive ARG
-                    if dt.tzinfo is None:
-                        cierre = dt  # ya naive (se asume ARG)
-                    else:
-                        cierre = dt.astimezone(ARG_TZ).replace(tzinfo=None)
-                except Exception:
-                    # fallback: ahora en ARG
-                    cierre = datetime.now(tz=ARG_TZ).replace(tzinfo=None)
-            elif isinstance(fecha, datetime):
-                dt = fecha
-                if dt.tzinfo is None:
-                    cierre = dt  # asumimos ya hora ARG naive
-                else:
-                    cierre = dt.astimezone(ARG_TZ).replace(tzinfo=None)
-            else:
-                cierre = datetime.now(tz=ARG_TZ).replace(tzinfo=None)
-
-        f.fecha_cierre = cierre
+        f.fecha_cierre = fecha_arg(fecha)
         f.save()
         return f.pk
 
@@ -133,6 +131,14 @@ async def handle_finish(id_flow_pk, plantilla_name=None):
     """
     logger.info("handle_finish called for flow %s plantilla_name=%s", id_flow_pk, plantilla_name)
 
+    # recordatorios que esperaban el cierre de este Flow
+    try:
+        liberados = await asyncio.to_thread(liberar_flow, id_flow_pk)
+        if liberados:
+            logger.info("Flow %s cerrado: %s recordatorios liberados", id_flow_pk, liberados)
+    except Exception:
+        logger.exception("Error liberando recordatorios en espera del flow %s", id_flow_pk)
+
     def _():
         logger.info("ENTER _work handle_finish for %s", id_flow_pk)
         from src.models import TurnoFlow, Turno, MsgFlowEnv
@@ -204,8 +210,50 @@ async def create_msgflowenv(id_flow_pk, fecha_hora, nodo_obj):
         return MsgFlowEnv.objects.create(id_flow_id=id_flow_pk, fecha_hora=fecha_hora, id_nodo=nodo_obj)
     return await asyncio.to_thread(_create)
 
-# ---------------- handler ----------------
-async def handler(request: web.Request):
+# ---------------- acks de mensajes ----------------
+class AckBuffer:
+    """
+    Junta los callbacks de estado de mensajes y los aplica por lotes
+    (cada ACK_FLUSH_SECONDS o al llegar a ACK_LOTE claves). Para la misma
+    clave (id_mensaje, sesion) queda el ack más alto recibido.
+    """
+    def __init__(self):
+        self.pendientes = {}
+        self.lleno = asyncio.Event()
+
+    def agregar(self, id_mensaje, sesion, ack, fecha):
+        clave = (str(id_mensaje), str(sesion) if sesion is not None else None)
+        previo = self.pendientes.get(clave)
+        if previo is None or ack > previo[0]:
+            self.pendientes[clave] = (ack, fecha)
+        if len(self.pendientes) >= ACK_LOTE:
+            self.lleno.set()
+
+    async def volcar(self):
+        if not self.pendientes:
+            return
+        lote, self.pendientes = self.pendientes, {}
+        try:
+            n = await asyncio.to_thread(aplicar_acks, lote)
+            logger.info("Acks aplicados: %s de %s recibidos", n, len(lote))
+        except Exception:
+            logger.exception("Fallo aplicando %s acks, se reintenta en el próximo lote", len(lote))
+            for (id_mensaje, sesion), (ack, fecha) in lote.items():
+                self.agregar(id_mensaje, sesion, ack, fecha)
+
+    async def correr(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(self.lleno.wait(), ACK_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.lleno.clear()
+            await self.volcar()
+        await self.volcar()
+
+acks = AckBuffer()
+
+def check_local(request: web.Request):
     # check peer is localhost (extra safety)
     peer = request.transport.get_extra_info("peername")
     if peer:
@@ -214,6 +262,35 @@ async def handler(request: web.Request):
             logger.warning("Rejected non-local request from %s", peer_ip)
             raise web.HTTPForbidden(text="Only localhost allowed")
 
+async def ack_handler(request: web.Request):
+    """
+    Callback de estado de mensajes: {"id", "session", "ack", "time"} o una
+    lista de ellos. Se encolan y se responde enseguida; el guardado es por lotes.
+    """
+    check_local(request)
+    data = await parse_request_json(request)
+    items = data if isinstance(data, list) else [data] if isinstance(data, dict) else None
+    if not items:
+        raise web.HTTPBadRequest(text="Invalid payload")
+
+    aceptados = 0
+    for item in items:
+        try:
+            id_mensaje = item["id"]
+            ack = int(item["ack"])
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Ack inválido: %s", item)
+            continue
+        if id_mensaje is None:
+            continue
+        acks.agregar(id_mensaje, item.get("session"), ack, fecha_arg(item.get("time")))
+        aceptados += 1
+    return web.json_response({"ok": True, "accepted": aceptados}, status=202)
+
+# ---------------- handler ----------------
+async def handler(request: web.Request):
+    check_local(request)
+
     data = await parse_request_json(request)
     if data is None:
         logger.warning("Invalid/empty payload")
@@ -273,6 +350,7 @@ async def handler(request: web.Request):
 def create_app():
     app = web.Application(client_max_size=MAX_BODY_BYTES)
     app.router.add_post(f"/{ENDPOINT}", handler)
+    app.router.add_post(f"/{ENDPOINT_ACK}", ack_handler)
     async def health(request): return web.json_response({"ok": True})
     app.router.add_get("/_health", health)
     return app
@@ -286,6 +364,7 @@ async def main_async():
     logger.info(f"Internal server listening on http://{HOST}:{PORT}/{ENDPOINT}")
 
     stop = asyncio.Event()
+    volcador = asyncio.create_task(acks.correr(stop))
 
     def _on_signal():
         logger.info("Shutdown signal received")
@@ -297,6 +376,7 @@ async def main_async():
 
     await stop.wait()
     await runner.cleanup()
+    await volcador
 
 def main():
     try:
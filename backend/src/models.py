@@ -79,6 +79,24 @@ class Especialidad(models.Model):
         ordering = ['nombre']
 
 
+class EfectorDireccion(models.Model):
+    id_efector = models.OneToOneField(
+        Efector, models.DO_NOTHING, primary_key=True, db_column='id_efector')
+    nombre = models.CharField(max_length=64, null=True, blank=True)
+    calle = models.CharField(max_length=64, null=True, blank=True)
+    altura = models.CharField(max_length=10, null=True, blank=True)
+    letra = models.CharField(max_length=4, null=True, blank=True)
+    coordx = models.CharField(max_length=32, null=True, blank=True)
+    coordy = models.CharField(max_length=32, null=True, blank=True)
+    telefono = models.CharField(max_length=32, null=True, blank=True)
+    calle_nom = models.CharField(max_length=64, null=True, blank=True)
+    fecha_sync = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'efector_direccion'
+
+
 class EfeSerEsp(models.Model):
     id  = models.IntegerField(primary_key=True)
     id_efector  = models.ForeignKey(
@@ -148,6 +166,8 @@ class Mensaje(models.Model):
         Plantilla, models.DO_NOTHING, db_column='id_plantilla')
     fecha_envio = models.DateTimeField()
     fecha_last_ack = models.DateTimeField(null=True, blank=True)
+    fecha_ultima_consulta = models.DateTimeField(null=True, blank=True)  # último polling, con o sin respuesta
+    fecha_callback = models.DateTimeField(null=True, blank=True)  # primer callback del gateway; deja de consultarse
     id_estado = models.ForeignKey(
         EstadoMsj, models.DO_NOTHING, db_column='id_estado')
 
@@ -276,6 +296,74 @@ class LastMod(models.Model):
         db_table = "last_mod"
 
 
+class EventoProcesado(models.Model):
+    id = models.AutoField(primary_key=True)
+    id_turno = models.IntegerField()
+    fecha_hora_mdf = models.CharField(max_length=26)
+    id_estado_turno = models.SmallIntegerField()
+    fecha_registro = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = "evento_procesado"
+        unique_together = (("id_turno", "fecha_hora_mdf", "id_estado_turno"),)
+
+
+class BandejaSalida(models.Model):
+    # estados de la fila
+    PENDIENTE = 0
+    ENVIANDO = 1
+    HECHO = 2
+    FALLIDO = -1
+
+    id = models.AutoField(primary_key=True)
+    id_turno = models.ForeignKey(
+        Turno, models.DO_NOTHING, db_column='id_turno')
+    id_plantilla = models.ForeignKey(
+        Plantilla, models.DO_NOTHING, db_column='id_plantilla')
+    tipo_aviso = models.SmallIntegerField()  # 1 conf, 2 canc, 3 repr, 4 reco
+    # evento de turnoshistorico que originó el aviso (como EventoProcesado)
+    fecha_hora_mdf = models.CharField(max_length=26)
+    id_estado_turno = models.SmallIntegerField()
+    numero = models.CharField(max_length=16)
+    texto = models.TextField()
+    estado = models.SmallIntegerField(default=0)
+    intentos = models.IntegerField(default=0)
+    fecha_alta = models.DateTimeField()
+    fecha_proximo = models.DateTimeField()
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = False
+        db_table = "bandeja_salida"
+        unique_together = (("id_turno", "fecha_hora_mdf", "id_estado_turno"),)
+
+
+class EnvioProgramado(models.Model):
+    # estados de la fila
+    PENDIENTE = 0
+    ENVIANDO = 1
+    HECHO = 2
+    CANCELADO = 3
+    FALLIDO = -1
+
+    id = models.AutoField(primary_key=True)
+    id_turno = models.ForeignKey(
+        Turno, models.DO_NOTHING, db_column='id_turno')
+    tipo_aviso = models.SmallIntegerField()  # 4 reco
+    fecha_programada = models.DateTimeField()
+    estado = models.SmallIntegerField(default=0)
+    intentos = models.IntegerField(default=0)
+    snapshot = models.CharField(max_length=64)  # clave de src.utils.snapshots
+    fecha_alta = models.DateTimeField()
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = False
+        db_table = "envio_programado"
+        unique_together = (("id_turno", "tipo_aviso"),)
+
+
 
 class TipoNodo(models.Model):
     id = models.AutoField(primary_key=True)
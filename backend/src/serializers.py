@@ -7,14 +7,15 @@ from rest_framework import serializers
 from src.models import (Plantilla, EstadoMsj, EstadoTurno,
                 Turno, Mensaje, Efector, Servicio, Especialidad, Deriva, EfeSerEspPlantilla,
                 EstadoTurnoEspera, TurnoEspera, EfeSerEsp, EstudioRequerido, EstadoTurnoPaciente, Flow, TurnoFlow)
-from src.utils.utils import fetch_paciente, fetch_profesional, update_msg_state
+from src.utils.utils import fetch_paciente, fetch_profesional
+from src.utils import catalogo, plantillas, telefonos
 import re
 from django.utils import timezone
 from datetime import datetime, date
-from concurrent.futures import ThreadPoolExecutor
 
 class PlantillaSerializer(serializers.ModelSerializer):
     contenido = serializers.SerializerMethodField()
+    placeholders_desconocidos = serializers.SerializerMethodField()
 
     class Meta:
         model = Plantilla
@@ -23,6 +24,9 @@ class PlantillaSerializer(serializers.ModelSerializer):
     def get_contenido(self, obj):
         return emoji.emojize(obj.contenido or "")
 
+    def get_placeholders_desconocidos(self, obj):
+        return sorted(plantillas.desconocidos(obj.contenido))
+
 class EstadoMsjSerializer(serializers.ModelSerializer):
     class Meta:
         model = EstadoMsj
@@ -85,15 +89,32 @@ class EfeSerEspSerializer(serializers.ModelSerializer):
 
 
 class DerivaSerializer(serializers.ModelSerializer):
-    efector = EfectorSerializer(source='id_efector', read_only=True)
-    efector_deriva = EfectorSerializer(source='id_efe_ser_esp_deriva.id_efector', read_only=True)
-    servicio_deriva = ServicioSerializer(source='id_efe_ser_esp_deriva.id_servicio', read_only=True)
-    especialidad_deriva = EspecialidadSerializer(source='id_efe_ser_esp_deriva.id_especialidad', read_only=True)
+    # catálogo desde la caché del proceso (sin joins por fila)
+    efector = serializers.SerializerMethodField()
+    efector_deriva = serializers.SerializerMethodField()
+    servicio_deriva = serializers.SerializerMethodField()
+    especialidad_deriva = serializers.SerializerMethodField()
 
     class Meta:
         model = Deriva
         fields = ['id', 'cupo', 'efector', 'efector_deriva', 'servicio_deriva', 'especialidad_deriva']
 
+    def get_efector(self, obj):
+        return catalogo.efector(obj.id_efector_id)
+
+    def _deriva(self, obj, campo):
+        ese = catalogo.efe_ser_esp(obj.id_efe_ser_esp_deriva_id)
+        return ese[campo] if ese else None
+
+    def get_efector_deriva(self, obj):
+        return self._deriva(obj, "efector")
+
+    def get_servicio_deriva(self, obj):
+        return self._deriva(obj, "servicio")
+
+    def get_especialidad_deriva(self, obj):
+        return self._deriva(obj, "especialidad")
+
 class EfeSerEspEfectorSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(source="id_efector.id", read_only=True)
     nombre = serializers.CharField(source="id_efector.nombre", read_only=True)
@@ -212,9 +233,11 @@ class PacienteSerializer(serializers.Serializer):
     def to_representation(self, instance):
         rep = super().to_representation(instance)
         if rep.get("carac_telef"):
-            rep["carac_telef"] = str(rep["carac_telef"]).replace(" ", "")
+            rep["carac_telef"] = telefonos.limpiar(rep["carac_telef"])
         if rep.get("nro_telef"):
-            rep["nro_telef"] = str(rep["nro_telef"]).replace(" ", "")
+            rep["nro_telef"] = telefonos.limpiar(rep["nro_telef"])
+        # número de WhatsApp normalizado (None si no se le puede enviar)
+        rep["telefono"] = telefonos.normalizar(rep.get("carac_telef"), rep.get("nro_telef"))
         return rep
 
 class ProfesionalSerializer(serializers.Serializer):
@@ -231,10 +254,11 @@ class EstudioRequeridoSerializer(serializers.ModelSerializer):
 
 class TurnoEsperaSerializer(serializers.ModelSerializer):
     estado = EstadoTurnoEsperaSerializer(source='id_estado', read_only=True)
-    efector =  EfectorSerializer(source='id_efe_ser_esp.id_efector', read_only=True)
-    servicio = ServicioSerializer(source='id_efe_ser_esp.id_servicio', read_only=True)
-    especialidad = EspecialidadSerializer(source='id_efe_ser_esp.id_especialidad', read_only=True)
-    efector_solicitante = EfectorSerializer(source='id_efector_solicitante', read_only=True)
+    # catálogo desde la caché del proceso (sin joins por fila)
+    efector = serializers.SerializerMethodField()
+    servicio = serializers.SerializerMethodField()
+    especialidad = serializers.SerializerMethodField()
+    efector_solicitante = serializers.SerializerMethodField()
     # campos adicionales para paciente y profesional
     paciente = serializers.SerializerMethodField()
     profesional_solicitante = serializers.SerializerMethodField()
@@ -247,6 +271,22 @@ class TurnoEsperaSerializer(serializers.ModelSerializer):
                   "usuario_cierre", "usuario_creacion", "fecha_hora_creacion", 
                   "fecha_hora_cierre", "estudio_requerido"]   
 
+    def _efe_ser_esp(self, obj, campo):
+        ese = catalogo.efe_ser_esp(obj.id_efe_ser_esp_id)
+        return ese[campo] if ese else None
+
+    def get_efector(self, obj):
+        return self._efe_ser_esp(obj, "efector")
+
+    def get_servicio(self, obj):
+        return self._efe_ser_esp(obj, "servicio")
+
+    def get_especialidad(self, obj):
+        return self._efe_ser_esp(obj, "especialidad")
+
+    def get_efector_solicitante(self, obj):
+        return catalogo.efector(obj.id_efector_solicitante_id)
+
     def get_paciente(self, obj):
         try:
             data = fetch_paciente(id_persona=obj.id_paciente)
@@ -394,7 +434,7 @@ class HistoricoPacienteSerializer(serializers.Serializer):
 
 
 class TurnoMergedSerializer(serializers.ModelSerializer):
-    efe_ser_esp  = EfeSerEspCompletoSerializer(source="id_efe_ser_esp", read_only=True)
+    efe_ser_esp  = serializers.SerializerMethodField()
 
     msj_recordatorio = serializers.IntegerField(read_only=True, allow_null=True)
     msj_confirmado = serializers.IntegerField(read_only=True, allow_null=True)
@@ -426,9 +466,7 @@ class TurnoMergedSerializer(serializers.ModelSerializer):
     
     @staticmethod
     def procesar_mensaje(m: Mensaje):
-        if 0 <= m.id_estado_id < 3:
-            update_msg_state(m)
-
+        # el estado lo mantiene al día refrescar_estados_mensajes; acá solo se lee
         return {
             "id": m.id,
             "id_mensaje": m.id_mensaje,
@@ -463,10 +501,12 @@ class TurnoMergedSerializer(serializers.ModelSerializer):
              .order_by("-fecha_envio")
             )
         
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            dic = list(executor.map(self.procesar_mensaje, mensajes))
-        return dic
+        return [self.procesar_mensaje(m) for m in mensajes]
     
+    def get_efe_ser_esp(self, obj):
+        # misma forma que EfeSerEspCompletoSerializer, desde la caché de catálogo
+        return catalogo.efe_ser_esp(obj.id_efe_ser_esp_id)
+
     def get_fecha_estado_paciente(self, obj):
         flow_ids = TurnoFlow.objects.filter(id_turno=obj.id).values_list("id_flow", flat=True)
 
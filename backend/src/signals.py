@@ -1,7 +1,9 @@
 # app/signals.py
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import EfeSerEspPlantilla, RegistroBanderas
+from .models import (EfeSerEspPlantilla, RegistroBanderas, Efector, Servicio, Especialidad, EfeSerEsp,
+                     Plantilla)
+from .utils import catalogo, config_notif, plantillas
 
 BANDERA_CONFIRMACION = 1
 BANDERA_CANCELACION = 2
@@ -14,6 +16,8 @@ def auditar_cambios(sender, instance, **kwargs):
     Detecta cambios en campos relevantes de EfeSerEspPlantilla y crea registros en RegistroBanderas.
     Requiere que, antes de guardar, si se desea guardar el usuario, se setee instance._usuario (ej: en admin).
     """
+    config_notif.invalidar()
+
     # Si es creación, no auditamos cambios
     if not instance.pk:
         return
@@ -74,3 +78,30 @@ def auditar_cambios(sender, instance, **kwargs):
             plantilla=cambio["plantilla"],
             dias_antes=cambio["dias_antes"]
         )
+
+
+@receiver([post_save, post_delete], sender=Efector)
+@receiver([post_save, post_delete], sender=Servicio)
+@receiver([post_save, post_delete], sender=Especialidad)
+@receiver([post_save, post_delete], sender=EfeSerEsp)
+def invalidar_catalogo(sender, **kwargs):
+    """Cualquier cambio en las tablas de catálogo descarta la caché del proceso."""
+    catalogo.invalidar()
+
+
+@receiver([post_save, post_delete], sender=EfeSerEspPlantilla)
+@receiver([post_save, post_delete], sender=Plantilla)
+def invalidar_config_notif(sender, **kwargs):
+    """
+    Descarta la configuración de avisos también después de escribir, para no
+    quedarse con lo leído por otro hilo entre el pre_save y el guardado.
+    """
+    config_notif.invalidar()
+
+
+@receiver(post_save, sender=Plantilla)
+def revisar_placeholders(sender, instance, **kwargs):
+    """Avisa si la plantilla guardada usa placeholders que ningún envío completa."""
+    faltan = plantillas.desconocidos(instance.contenido)
+    if faltan:
+        print(f"[WARN] Plantilla id={instance.pk} con placeholders desconocidos: {', '.join(sorted(faltan))}")
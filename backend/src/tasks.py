@@ -5,259 +5,522 @@ from datetime import timedelta, datetime, date, time
 from django.utils.timezone import make_aware
 from celery import shared_task
 from django.conf import settings
-from django.db import connections, transaction, connection as default_connection
-from django.db.models import OuterRef, Subquery, Exists, IntegerField, Max
+from django.db import connections, transaction, connection as default_connection, DatabaseError
+from django.db.models import OuterRef, Subquery, Exists, IntegerField, Max, F, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from src.models import (Turno, Plantilla, Mensaje, LastMod,
                         EfeSerEspPlantilla, EstadoTurno, Efector, Servicio,
                         Especialidad, EfeSerEsp, Flow, TurnoFlow, PlantillaFlow)
-from src.utils.utils import enviar_whatsapp, check_turno, format_plantilla, start_flow
+from src.utils.utils import enviar_whatsapp, check_turno, start_flow
 import random
-from src.utils.querys_informix import query_detalles_turno, query_efector, query_persona, query_turnos_historico
+from src.utils.querys_informix import (query_detalles_turno, query_persona,
+                                       query_turnos_historico, query_turnos_historico_instante)
 from src.utils.parse import parse_date, parse_time
-from src.utils.utils import create_Turno, update_estado_Turno, create_Mensaje, map_estdo, decode_res, sacar_Turno_Espera, create_flow
+from src.utils.utils import (create_Mensaje, map_estdo, decode_res, sacar_Turno_Espera,
+                             create_flow, fetch_por_lotes, coalescer_eventos, UnidadDeTrabajo, SumarDias)
+from src.utils.locks import PollLock
+from src.utils import catalogo, plantillas, limitador
+from src.utils.ledger import ya_procesados, clave_evento, podar
+from src.utils.estados import refrescar_pendientes
+from src.utils.bandeja import despachar
+from src.utils import programados
+from src.utils.espera_flow import esperar as esperar_flow
+from src.utils.programados import valores as valores_recordatorio
+from src.utils.snapshots import (CAMPOS as CAMPOS_SNAPSHOT, de_detalle as snapshot_de_detalle,
+                                 clave_nueva as snapshot_nuevo, guardar as guardar_snapshot,
+                                 hidratar as hidratar_snapshots, recargar as recargar_snapshots)
+from src.utils.telefonos import (telefono_paciente, rechazados as telefonos_rechazados,
+                                 registrar_resultado as registrar_resultado_tel)
+from src.utils.reenvios import encolar as encolar_reenvio, drenar as drenar_cola_reenvio
+from src.utils.efectores import direcciones as direcciones_efector, sincronizar as sincronizar_direcciones
+from src.utils.simulacion import Resumen, atomica, corrida as corrida_simulada, en_corrida as en_simulacion
 from rest_framework.response import Response
 
 TZ = ZoneInfo("America/Argentina/Buenos_Aires")
 
 
+def _cargar_ventana(cur, transiciones, uow: UnidadDeTrabajo) -> dict:
+    """
+    Resuelve en bloque los datos de Informix y locales que necesita una ventana
+    de transiciones: los Turno locales existentes, detalles de turnos a crear
+    o a avisar como asignados/reprogramados y, para los avisos de suspensión,
+    persona y EfeSerEsp. La dirección y contacto de los efectores se leen de
+    la copia local (efector_direccion).
+    """
+    uow.cargar_turnos((tr["idturno"], tr["idpaciente"]) for tr in transiciones if not tr["crear"])
+
+    ids_detalle = [tr["idturno"] for tr in transiciones if tr["crear"] or tr["notificar"] in (1, 3)]
+    susp = [(tr["idturno"], tr["idpaciente"]) for tr in transiciones if tr["notificar"] == 2]
+
+    detalles = fetch_por_lotes(cur, query_detalles_turno, ids_detalle)
+    personas = fetch_por_lotes(cur, query_persona, [idpaciente for _, idpaciente in susp])
+
+    ids_efector = {fila[1] for fila in detalles.values()}
+    for clave in susp:
+        t = uow.turno(*clave)
+        ese = catalogo.efe_ser_esp(t.id_efe_ser_esp_id) if t is not None else None
+        if ese and ese["efector"]:
+            ids_efector.add(ese["efector"]["id"])
+    efectores = direcciones_efector(ids_efector)
+
+    return {
+        "detalles": detalles,
+        "personas": personas,
+        "rechazados": telefonos_rechazados(tr["idpaciente"] for tr in transiciones),
+        "efectores": efectores,
+    }
+
+
+HISTORICO_PAGE_SIZE = 500
+
+
+def _leer_pagina_historico(cur, desde: str) -> tuple[list, bool]:
+    """
+    Lee la siguiente página de turnoshistorico posterior a `desde`.
+    Devuelve (filas, hay_mas). Si la página viene llena se postergan las filas
+    del último instante para no cortar un mismo fecha_hora_mdf entre páginas.
+    """
+    cur.execute(query_turnos_historico(HISTORICO_PAGE_SIZE), [desde])
+    filas = cur.fetchmany(HISTORICO_PAGE_SIZE)
+    if len(filas) < HISTORICO_PAGE_SIZE:
+        return filas, False
+
+    ultimo = filas[-1][3]
+    pagina = [f for f in filas if f[3] != ultimo]
+    if not pagina:
+        # toda la página comparte instante: se trae ese instante completo
+        cur.execute(query_turnos_historico_instante(), [ultimo])
+        pagina = cur.fetchall()
+    return pagina, True
+
+
 @shared_task
-def verificar_turnos() -> None:
+def verificar_turnos(simulacion=False, desde=None) -> None:
+    """
+    Con simulacion=True la pasada lee y arma los avisos de verdad pero los
+    envíos van al registro de simulación y las escrituras se descartan
+    (ver src.utils.simulacion). `desde` reemplaza a LastMod para reproducir
+    un período ("YYYY-MM-DD HH:MM:SS").
+    """
     print(f"[{timezone.now()}] Ejecutando verificación de turnos...")
-    
+
+    if simulacion:
+        # lock propio: no compite con el poll real ni avanza LastMod
+        lock = PollLock("verificar_turnos_simulacion", settings.POLL_LOCK_LEASE)
+        if not lock.adquirir():
+            print("[WARN] Ya hay una simulación de verificar_turnos en curso")
+            return
+        resumen = Resumen("verificar_turnos")
+        try:
+            with corrida_simulada():
+                _verificar_turnos_pasada(lock, resumen, desde)
+        finally:
+            lock.liberar()
+            resumen.emitir()
+        return
+
+    # Una sola ejecución a la vez: un tick tardío se saltea y se absorbe en la pasada en curso
+    try:
+        lock = PollLock("verificar_turnos", settings.POLL_LOCK_LEASE)
+        adquirido = lock.adquirir()
+    except Exception as e:
+        print(f"[ERROR] al tomar el lock de verificar_turnos: {e}")
+        return
+
+    if not adquirido:
+        saltados = lock.registrar_salto()
+        print(f"[WARN] verificar_turnos sigue en curso, se saltea el tick (saltados={saltados})")
+        return
+
+    resumen = Resumen("verificar_turnos")
+    try:
+        for pasada in range(settings.POLL_MAX_PASADAS):
+            if not _verificar_turnos_pasada(lock, resumen):
+                break
+            if not lock.tomar_pendiente():
+                break
+            print(f"[INFO] Ticks salteados durante la pasada {pasada + 1}, se procesa lo nuevo ({lock.contadores()})")
+    finally:
+        lock.liberar()
+        resumen.emitir()
+
+
+def _verificar_turnos_pasada(lock: PollLock, resumen: Resumen, desde_fijo: str | None = None) -> bool:
+    """Procesa turnoshistorico desde LastMod (o desde_fijo). False si la pasada se cortó."""
     # Obtener/crear LastMod 
     try:
         last_mod_obj = LastMod.objects.first()
         if last_mod_obj: 
             last_mod_raw = last_mod_obj.fecha
         else:
-            return
+            return False
     except Exception as e:
         print(f"[ERROR] al obtener/crear LastMod: {e}")
-        return
+        return False
 
     try:
         conn = connections['informix']
         with conn.cursor() as cur:
-            lm_param = last_mod_raw.strftime("%Y-%m-%d %H:%M:%S")
-            print(f"[DEBUG] Usando last_mod para consulta Informix: {lm_param!r}")
+            # se relee un margen antes de LastMod: lo ya procesado lo descarta el registro de eventos
+            inicio = last_mod_raw - timedelta(seconds=settings.POLL_SOLAPAMIENTO)
+            desde = desde_fijo or inicio.strftime("%Y-%m-%d %H:%M:%S")
+            print(f"[DEBUG] Usando last_mod para consulta Informix: {desde!r}")
+
+            # en simulación cada página se deshace, también su registro de eventos:
+            # lo visto en esta corrida se recuerda aparte y el registro no se consulta
+            vistos = set() if en_simulacion() else None
+            hay_mas = True
+            while hay_mas:
+                try:
+                    with resumen.etapa("historico"):
+                        filas, hay_mas = _leer_pagina_historico(cur, desde)
+                except Exception as ex:
+                    print(f"[ERROR] al ejecutar consulta de notificaciones con param {desde!r}: {ex}")
+                    return False
+
+                if not filas:
+                    break
+                resumen.sumar("filas", len(filas))
+
+                # Heartbeat antes de cualquier efecto: si el lease venció y otro run
+                # tomó el lock, esta pasada se corta
+                if not lock.renovar():
+                    print("[WARN] Se perdió el lock de verificar_turnos, se corta la pasada")
+                    return False
+
+                procesados = vistos if vistos is not None else ya_procesados(filas)
+                eventos = []
+                claves = []
+                for r in filas:
+                    idturno, idpaciente, idestadoturno, last_modf_val = r
+                    clave = clave_evento(idturno, last_modf_val, idestadoturno)
+                    if clave in procesados:
+                        continue
+                    print(f"[DEBUG] notificacion raw: {r}")
+                    claves.append(clave)
+                    # Mapeo de idestadoturno -> estado (restaurado al mapping esperado)
+                    eventos.append((idturno, idpaciente, map_estdo(idestadoturno), last_modf_val, idestadoturno))
+
+                if len(claves) < len(filas):
+                    print(f"[DEBUG] {len(filas) - len(claves)} eventos ya procesados, se omiten")
+                if vistos is not None:
+                    vistos.update(claves)
+
+                # Una transición por turno/paciente antes de cualquier efecto
+                transiciones = coalescer_eventos(eventos)
+                if len(transiciones) < len(eventos):
+                    print(f"[DEBUG] {len(eventos)} eventos coalescidos en {len(transiciones)} transiciones")
+
+                # Todas las consultas de detalle de la página, por bloques
+                resumen.sumar("transiciones", len(transiciones))
+                uow = UnidadDeTrabajo()
+                try:
+                    with resumen.etapa("ventana"):
+                        ventana = _cargar_ventana(cur, transiciones, uow)
+                except Exception as ex:
+                    print(f"[ERROR] al cargar detalles de la ventana: {ex}")
+                    return False
+
+                with resumen.etapa("procesar"):
+                    for tr in transiciones:
+                        _procesar_transicion(tr, ventana, uow)
+                uow.registrar_eventos(claves)
+                resumen.sumar("avisos", len(uow.avisos))
+                if uow.avisos:
+                    uow.al_confirmar(despachar_bandeja.delay)
+
+                # Checkpoint: las escrituras de la página y LastMod en una sola transacción
+                # (descartada al terminar la página si es una corrida simulada)
+                desde = str(filas[-1][3])
+                try:
+                    marca = datetime.strptime(desde.split(".")[0], "%Y-%m-%d %H:%M:%S")
+                    with resumen.etapa("guardar"), atomica():
+                        try:
+                            uow.flush()
+                        except DatabaseError as ex:
+                            # una fila mala no frena la ingesta: se reintenta de a una
+                            print(f"[WARN] Falló el guardado en bloque de la página ({ex}), se reintenta fila por fila")
+                            descartadas = uow.flush_por_filas()
+                            print(f"[WARN] {descartadas} escrituras descartadas en la página")
+                        # LastMod nunca retrocede aunque la página sea del margen de solapamiento
+                        if marca > last_mod_raw:
+                            last_mod_obj.fecha = last_mod_raw = marca
+                            last_mod_obj.save(update_fields=['fecha'])
+                    print(f"[DEBUG] Actualizado LastMod.fecha = {last_mod_obj.fecha}")
+                except Exception as ex:
+                    print(f"[ERROR] al guardar la página / LastMod: {ex}")
+                    return False
 
-            try:
-                cur.execute(query_turnos_historico(), [lm_param])
-           
-            except Exception as ex:
-                print(f"[ERROR] al ejecutar consulta de notificaciones con param {lm_param!r}: {ex}")
-                return
+    except Exception as e:
+        print(f"[ERROR] Error en verificación de turnos: {e}")
+        return False
 
-            mejor_raw = None
+    return True
 
-            for r in cur.fetchall():
-                print(f"[DEBUG] notificacion raw: {r}")
-                idturno, idpaciente, idestadoturno, last_modf_val = r
 
-                este_raw = str(last_modf_val).split(".")[0]
-                if mejor_raw is None or este_raw > mejor_raw:
-                    mejor_raw = este_raw
+def _procesar_transicion(tr: dict, ventana: dict, uow: UnidadDeTrabajo) -> None:
+    idturno, idpaciente = tr["idturno"], tr["idpaciente"]
+    estado, notificar = tr["estado"], tr["notificar"]
 
-                # Mapeo de idestadoturno -> estado (restaurado al mapping esperado)
-                estado = map_estdo(idestadoturno)
+    # Inicializo variables que luego uso (mínimo)
+    id_efe_ser_esp = None
+    id_efector = id_servicio = id_especialidad = None
+    nombre_servicio = nombre_especialidad = nombre_efector = None
+    calle = altura = letra = coordx = coordy = tel_efe = calle_nom = None
+    carac_tel = tel = nom_pac = ape_pac = nom_prof = ape_prof = None
+    d_fecha = d_hora = None
 
-                # Inicializo variables que luego uso (mínimo)
-                id_efe_ser_esp = None
-                id_efector = id_servicio = id_especialidad = None
-                nombre_servicio = nombre_especialidad = nombre_efector = None
-                calle = altura = letra = coordx = coordy = tel_efe = calle_nom = None
-                carac_tel = tel = nom_pac = ape_pac = nom_prof = ape_prof = None
-                d_fecha = d_hora = None
+    # Si se crea o se avisa confirmación/reprogramación tomo los detalles ya cargados
+    if tr["crear"] or notificar in (1, 3):
+        detalles = ventana["detalles"].get(idturno)
+        if not detalles:
+            print(f"[DEBUG] No hay detalles para idturno={idturno}")
+            return
 
-                # Si corresponde (0 o 3) traigo detalles completos
-                detalles = None
-                if estado in (1, 3):
-                    try:
-                        cur.execute(query_detalles_turno(1), [idturno])
-                        detalles = cur.fetchone()
-                    
-                    except Exception as ex:
-                        print(f"[ERROR] al ejecutar make_query() para idturno={idturno}: {ex}")
-                        continue
+        (
+            _id_from_row, id_efector, id_servicio, id_especialidad, id_efe_ser_esp ,
+            tipo_doc, nro_doc, ape_pac, nom_pac, fecha_turno, hora_turno,
+            ape_prof, nom_prof, nombre_servicio, nombre_especialidad,
+            nombre_efector, calle, altura, letra, coordx, coordy,
+            tel_efe, calle_nom, carac_tel, tel
+        ) = detalles
+        # parsear
+        d_fecha = parse_date(fecha_turno)
+        d_hora = parse_time(hora_turno)
+        fecha = d_fecha.strftime("%d-%m-%Y")
+        hora = d_hora.strftime("%H:%M")
+
+        if tr["crear"] and catalogo.efe_ser_esp(id_efe_ser_esp) is None:
+            # la FK a efe_ser_esp haría fallar el alta (y con ella la página)
+            print(f"[WARN] EfeSerEsp {id_efe_ser_esp} no está en el catálogo local, se omite Turno id={idturno}")
+            return
 
-                    if not detalles:
-                        print(f"[DEBUG] No hay detalles para idturno={idturno}")
-                        continue
+        if tr["crear"]:
+            t = uow.crear_turno(idturno, idpaciente,estado,
+                id_efe_ser_esp, d_fecha, d_hora)
+            
+            print(f"[INFO] Creado Turno id={idturno} fecha={fecha} hora={hora}")
 
-                    (
-                        _id_from_row, id_efector, id_servicio, id_especialidad, id_efe_ser_esp ,
-                        tipo_doc, nro_doc, ape_pac, nom_pac, fecha_turno, hora_turno,
-                        ape_prof, nom_prof, nombre_servicio, nombre_especialidad,
-                        nombre_efector, calle, altura, letra, coordx, coordy,
-                        tel_efe, calle_nom, carac_tel, tel
-                    ) = detalles
-                    # parsear
-                    d_fecha = parse_date(fecha_turno)
-                    d_hora = parse_time(hora_turno)
-                    fecha = d_fecha.strftime("%d-%m-%Y")
-                    hora = d_hora.strftime("%H:%M")
-
-                    if estado == 1:
-                        try:
-                            t = create_Turno(idturno, idpaciente,estado,
-                                id_efe_ser_esp, d_fecha, d_hora)
-                            
-                            print(f"[INFO] Creado Turno id={idturno} fecha={fecha} hora={hora}")
-
-                            # b = sacar_Turno_Espera(idpaciente, id_efe_ser_esp)
-                            # if b:
-                            #     print(f"[INFO] Turno en Lista de Espera asignado idpaciente={idpaciente}")
-
-                        except Exception as ex:
-                            print(f"[ERROR] al crear Turno id={idturno}: {ex}")
-                            continue
-
-                if estado in (2, 3, 4):
-                    t = update_estado_Turno(idturno, idpaciente, estado)
-                    
-                    if t == None:
-                        continue
-                    # Si estado == 2 (suspendido) 
-                    if estado == 2:
-                            
-                        try:
-                            # obtener datos persona de forma segura
-                            cur.execute(query_persona(), [idpaciente])
-                            persona_row = cur.fetchone()
-                            if persona_row:
-                                ape_pac, nom_pac, carac_tel, tel = persona_row
-                            else:
-                                ape_pac = nom_pac = carac_tel = tel = None
-
-                            # --- cambio mínimo: obtener id_efe_ser_esp desde Turno si no lo tenemos
-                            id_efe_ser_esp = getattr(t, "id_efe_ser_esp_id", id_efe_ser_esp)
-
-                            # obtener EfeSerEsp para sacar efector/servicio/especialidad (asumimos que existe)
-                            ese_obj = EfeSerEsp.objects.select_related(
-                                "id_efector", "id_servicio", "id_especialidad"
-                            ).get(pk=id_efe_ser_esp)
-
-                            # IDs reales
-                            id_efector = ese_obj.id_efector_id
-                            id_servicio = ese_obj.id_servicio_id
-                            id_especialidad = ese_obj.id_especialidad_id
-
-                            # Valores reales (nombre)
-                            nombre_efector = ese_obj.id_efector.nombre
-                            nombre_servicio = ese_obj.id_servicio.nombre
-                            nombre_especialidad = ese_obj.id_especialidad.nombre
-                            # datos del efector vía cursor Informix
-                            nombre_efector = calle = altura = letra = coordx = coordy = tel_efe = calle_nom = None
-                            
-                            cur.execute(query_efector(), [id_efector])
-                            ef_row = cur.fetchone()
-                            if ef_row:
-                                (nombre_efector, calle, altura, letra,
-                                coordx, coordy, tel_efe, calle_nom) = ef_row
-
-                            # obtener fecha/hora guardadas en Turno (siempre strings según create)
-                            d_fecha = getattr(t, "fecha", None)
-                            d_hora = getattr(t, "hora", None)
-
-                            # intentar parsear sin hacer chequeos extra (cambio mínimo)
-
-                            fecha = parse_date(d_fecha).strftime("%d-%m-%Y")
-                            
-                            hora = parse_time(d_hora).strftime("%H:%M")
-
-
-                            nom_prof = None
-                            ape_prof = None
-                        except Exception as ex:
-                            print(f"[ERROR] al procesar estado 2 para idturno={idturno}: {ex}")
-                            continue
-
-                if estado == 4:
-                    continue
-
-                telefono = None
-                send, plantilla = check_turno(id_efe_ser_esp, estado)
-                if send and plantilla:
-                    if carac_tel and tel:
-                        telefono = ("549" + str(carac_tel) + str(tel)).replace(" ", "")
-
-                        datos_plantilla = {
-                            "nompac": nom_pac or "",
-                            "apepac": ape_pac or "",
-                            "fecha": fecha,
-                            "horaturno": hora,
-                            "nomprof": nom_prof or "",
-                            "apeprof": ape_prof or "",
-                            "especialidad": nombre_especialidad or "",
-                            "efector": nombre_efector or "",
-                            "servicio": nombre_servicio or "",
-                            "calle": calle or "",
-                            "altura": altura or "",
-                            "letra": letra or "",
-                            "coordx": coordx or "",
-                            "coordy": coordy or "",
-                            "tel_efe": tel_efe or "",
-                            "calle_nom": calle_nom or "",
-                        }
-
-                        mensaje = format_plantilla(plantilla.contenido, datos_plantilla)
-                        res = enviar_whatsapp(telefono, mensaje)
-                        response_data = getattr(res, "data", {})
-
-                        ack = decode_res(res)
-                        
-                        try:
-                            print("RESPONSE: ", response_data)
-                            id_mensaje=response_data.get("id", None)
-                            fecha_res =response_data.get("time", None)
-                            ses = response_data.get("session", None)
-                            create_Mensaje(id_mensaje,t, telefono, plantilla, ack, fecha_res, ses)
-                        
-                        except Exception as ex:
-                            print(f"[ERROR] al crear Mensaje para turno {idturno}: {ex}")
-                            continue
-
-                        if ack >= 0:  # actualizar flags en Turno
-                            try:
-                                if estado == 1:
-                                    t.msj_confirmado = 1
-                                    t.save(update_fields=["msj_confirmado"])
-                                elif estado == 2:
-                                    t.msj_cancelado = 1
-                                    t.save(update_fields=["msj_cancelado"])
-                                elif estado == 3:
-                                    t.msj_reprogramado = 1
-                                    t.save(update_fields=["msj_reprogramado"])
-                            except Exception as ex:
-                                print(f"[ERROR] al actualizar flags msj_* en Turno id={idturno}: {ex}")
-                    
-                    else:
-                        print(f"[DEBUG] No hay teléfono válido para idturno={idturno} (carac_tel={carac_tel}, tel={tel})")
-                        try:
-                            create_Mensaje(turno=t, plantilla=plantilla, estado=-3)
+            # b = sacar_Turno_Espera(idpaciente, id_efe_ser_esp)
+            # if b:
+            #     print(f"[INFO] Turno en Lista de Espera asignado idpaciente={idpaciente}")
 
-                        except Exception as ex:
-                            print(f"[ERROR] al crear Mensaje para turno {idturno}: {ex}")
-                else:
-                    print(f"[DEBUG] check_turno returned send={send}, plantilla={plantilla} for turno {idturno}")
+    if not tr["crear"]:
+        t = uow.turno(idturno, idpaciente)
+        if t is None:
+            print(f"[DEBUG] No existe Turno local con id={idturno} => se ignora notificación (estado={estado})")
+            return
 
-            # Al final: actualizar LastMod con mejor_raw EXACTO (SQL directo en default_connection)
+        uow.actualizar_estado(t, estado)
+        print(f"[INFO] Actualizado Turno id={idturno} a estado={estado}")
+        # Si se avisa suspensión
+        if notificar == 2:
+                
             try:
-                if mejor_raw is None:
-                    print("[DEBUG] No se encontró mejor_raw -> no se actualiza LastMod")
+                # datos persona de la carga en bloque
+                persona_row = ventana["personas"].get(idpaciente)
+                if persona_row:
+                    _, ape_pac, nom_pac, carac_tel, tel = persona_row
                 else:
-                    
-                    last_mod_obj.fecha = mejor_raw
-                    last_mod_obj.save(update_fields=['fecha'])
+                    ape_pac = nom_pac = carac_tel = tel = None
 
-                    print(f"[DEBUG] Actualizado LastMod.fecha = {last_mod_obj.fecha}")
+                # --- cambio mínimo: obtener id_efe_ser_esp desde Turno si no lo tenemos
+                id_efe_ser_esp = getattr(t, "id_efe_ser_esp_id", id_efe_ser_esp)
+
+                # EfeSerEsp desde la caché de catálogo (asumimos que existe)
+                ese = catalogo.efe_ser_esp(id_efe_ser_esp)
+
+                # IDs reales
+                id_efector = ese["efector"]["id"]
+                id_servicio = ese["servicio"]["id"]
+                id_especialidad = ese["especialidad"]["id"]
+
+                # Valores reales (nombre)
+                nombre_efector = ese["efector"]["nombre"]
+                nombre_servicio = ese["servicio"]["nombre"]
+                nombre_especialidad = ese["especialidad"]["nombre"]
+
+                # obtener fecha/hora guardadas en Turno (siempre strings según create)
+                d_fecha = getattr(t, "fecha", None)
+                d_hora = getattr(t, "hora", None)
+
+                # intentar parsear sin hacer chequeos extra (cambio mínimo)
+
+                fecha = parse_date(d_fecha).strftime("%d-%m-%Y")
+                
+                hora = parse_time(d_hora).strftime("%H:%M")
+
+
+                nom_prof = None
+                ape_prof = None
             except Exception as ex:
-                print(f"[ERROR] al actualizar LastMod con SQL directo: {ex}")
+                print(f"[ERROR] al procesar estado 2 para idturno={idturno}: {ex}")
+                return
+
+    if notificar is None:
+        if tr["eventos"] > 1:
+            print(f"[DEBUG] Sin aviso para idturno={idturno} tras coalescer {tr['eventos']} eventos (estado final={estado})")
+        return
 
+    # dirección y contacto del efector desde la copia local
+    ef_row = ventana["efectores"].get(id_efector)
+    if ef_row:
+        (_, nombre_efector, calle, altura, letra,
+        coordx, coordy, tel_efe, calle_nom) = ef_row
+
+    send, plantilla = check_turno(id_efe_ser_esp, notificar)
+    if send and plantilla:
+        telefono = telefono_paciente(idpaciente, carac_tel, tel, ventana["rechazados"])
+        if telefono:
+            datos_plantilla = {
+                "nompac": nom_pac,
+                "apepac": ape_pac,
+                "fecha": fecha,
+                "horaturno": hora,
+                "nomprof": nom_prof,
+                "apeprof": ape_prof,
+                "especialidad": nombre_especialidad,
+                "efector": nombre_efector,
+                "servicio": nombre_servicio,
+                "calle": calle,
+                "altura": altura,
+                "letra": letra,
+                "coordx": coordx,
+                "coordy": coordy,
+                "tel_efe": tel_efe,
+                "calle_nom": calle_nom,
+            }
+
+            mensaje = plantillas.render(plantilla, datos_plantilla)
+
+            # queda en la bandeja de salida, en la misma transacción que el turno
+            uow.encolar_aviso(t, plantilla, notificar, telefono, mensaje,
+                              evento=(tr["fecha_hora_mdf"], tr["id_estado_turno"]))
+            if en_simulacion():
+                # la corrida se descarta y el despachador no llega a verla: se registra acá
+                enviar_whatsapp(telefono, mensaje)
+            print(f"[INFO] Aviso preparado para turno {idturno} (estado={notificar})")
+        
+        else:
+            print(f"[DEBUG] No hay teléfono válido para idturno={idturno} (carac_tel={carac_tel}, tel={tel})")
+            uow.crear_mensaje(None, t, None, plantilla, -3, None, None)
+    else:
+        print(f"[DEBUG] check_turno returned send={send}, plantilla={plantilla} for turno {idturno}")
+
+
+
+@shared_task
+def enviar_notificacion(id_turno: int, id_plantilla: int, estado: int,
+                        telefono: str, mensaje: str, reenvios: int = 0) -> None:
+    """
+    Avisos encolados antes de la bandeja de salida (o desde la cola de
+    reenvío): se pasan a la bandeja y se despacha.
+    """
+    try:
+        turno = Turno.objects.get(pk=id_turno)
+        plantilla = Plantilla.objects.get(pk=id_plantilla)
+    except (Turno.DoesNotExist, Plantilla.DoesNotExist) as ex:
+        print(f"[WARN] enviar_notificacion sin turno/plantilla ({id_turno}, {id_plantilla}): {ex}")
+        return
+
+    uow = UnidadDeTrabajo()
+    uow.encolar_aviso(turno, plantilla, estado, telefono, mensaje)
+    uow.al_confirmar(despachar_bandeja.delay)
+    uow.flush()
+
+
+@shared_task
+def despachar_bandeja() -> None:
+    """
+    Envía los avisos pendientes de la bandeja de salida. Pueden correr varias
+    a la vez: cada una reclama filas distintas (SKIP LOCKED).
+    """
+    resumen = Resumen("despachar_bandeja")
+    with resumen.etapa("envio"):
+        cuenta = despachar(settings.BANDEJA_LOTE)
+    if cuenta["reclamados"]:
+        for k, v in cuenta.items():
+            resumen.sumar(k, v)
+        resumen.emitir()
+    # lote completo enviado: probablemente quedan más
+    if cuenta["enviados"] + cuenta["omitidos"] == settings.BANDEJA_LOTE:
+        despachar_bandeja.delay()
+
+
+@shared_task
+def despachar_programados() -> None:
+    """Envía los recordatorios vencidos de envio_programado (beat cada 5 s)."""
+    # una corrida a la vez; el lock vence con el lease de las filas reclamadas
+    try:
+        lock = PollLock("despachar_programados", programados.lease())
+        if not lock.adquirir():
+            return
     except Exception as e:
-        print(f"[ERROR] Error en verificación de turnos: {e}")
+        print(f"[ERROR] al tomar el lock de despachar_programados: {e}")
+        return
+    resumen = Resumen("despachar_programados")
+    try:
+        with resumen.etapa("envio"):
+            cuenta = programados.despachar(settings.PROGRAMADOS_LOTE)
+    finally:
+        lock.liberar()
+    if cuenta["reclamados"]:
+        for k, v in cuenta.items():
+            resumen.sumar(k, v)
+        resumen.emitir()
+    # lote completo: probablemente hay más vencidos
+    if cuenta["reclamados"] == settings.PROGRAMADOS_LOTE:
+        despachar_programados.delay()
+
+
+@shared_task
+def podar_eventos_procesados() -> None:
+    borrados = podar(settings.EVENTOS_RETENCION_DIAS)
+    print(f"[INFO] Registro de eventos: {borrados} entradas podadas")
+
+
+@shared_task
+def drenar_reenvios() -> None:
+    """Reencola los avisos pendientes de reenvío si el gateway está disponible."""
+    n = drenar_cola_reenvio(settings.REENVIO_LOTE)
+    if n:
+        print(f"[INFO] Reenvíos reencolados: {n}")
+        # si quedaron más, se sigue sin esperar al próximo tick
+        if n == settings.REENVIO_LOTE:
+            drenar_reenvios.apply_async(countdown=5)
+
+
+@shared_task
+def refrescar_estados_mensajes() -> None:
+    # una corrida a la vez: con la API lenta un tick no debe pisar al anterior
+    try:
+        lock = PollLock("refrescar_estados", settings.ESTADOS_PRESUPUESTO_SEG * 2)
+        if not lock.adquirir():
+            print("[WARN] refrescar_estados_mensajes sigue en curso, se saltea el tick")
+            return
+    except Exception as e:
+        print(f"[ERROR] al tomar el lock de refrescar_estados_mensajes: {e}")
+        return
+    try:
+        consultados, actualizados = refrescar_pendientes(settings.ESTADOS_LOTE, lock.renovar)
+    finally:
+        lock.liberar()
+    if consultados:
+        print(f"[INFO] Estados de mensajes: {consultados} consultados, {actualizados} actualizados")
+
 
+@shared_task
+def sincronizar_efectores(ids=None) -> None:
+    """
+    Refresca la copia local de dirección y contacto de los efectores.
+    Se programa a diario; llamarla a mano (o con ids) fuerza el refresco.
+    """
+    try:
+        n = sincronizar_direcciones(ids)
+        print(f"[INFO] Direcciones de efectores sincronizadas: {n}")
+    except Exception as ex:
+        print(f"[ERROR] al sincronizar direcciones de efectores: {ex}")
 
 
 SEND_TIME = time(10, 30)
@@ -266,49 +529,48 @@ BATCH_WINDOW_SECONDS = 300
 
 
 @shared_task
-def programar_recordatorios() -> None:
+def programar_recordatorios(simulacion=False) -> None:
+    """
+    Con simulacion=True se calculan candidatos, detalles y horarios de verdad
+    pero la agenda (envio_programado) se descarta al terminar.
+    """
     print(f"[{timezone.now().isoformat()}] Ejecutando recordatorios...")        
 
+    resumen = Resumen("programar_recordatorios")
     try:
-        hoy = datetime.now().date()
+        if simulacion:
+            with corrida_simulada():
+                _programar_recordatorios(resumen)
+        else:
+            _programar_recordatorios(resumen)
+    finally:
+        resumen.emitir()
 
-        efp_qs = (
-            EfeSerEspPlantilla.objects
-            .filter(
-                id_efe_ser_esp=OuterRef('id_efe_ser_esp'),
-                recordatorio=1
-            )
-        )
 
-        rango_fin = hoy + timedelta(days=5)
+def _programar_recordatorios(resumen: Resumen) -> None:
+    try:
+        hoy = datetime.now().date()
 
+        # Un solo join con la configuración y el vencimiento calculado en la base:
+        # fecha = hoy + dias_antes (índice idx_turno_recordatorio), sin tope de días
+        config = 'id_efe_ser_esp__efeserespplantilla'
         turnos_qs = (
             Turno.objects
-            .filter(id_estado=1, msj_recordatorio=0, fecha__range=(hoy, rango_fin))
+            .filter(**{f'{config}__recordatorio': 1}, id_estado=1, msj_recordatorio=0)
             .annotate(
-                efp_exists=Exists(efp_qs),
-                plantilla_reco=Subquery(efp_qs.values('plantilla_reco')[:1]),
-                dias_antes=Subquery(efp_qs.values('dias_antes')[:1]),
+                dias_antes=Coalesce(F(f'{config}__dias_antes'), 0),
+                plantilla_reco=F(f'{config}__plantilla_reco'),
             )
-            .filter(efp_exists=True)
+            .filter(fecha=SumarDias(Value(hoy), F('dias_antes')))
             .order_by('fecha', 'hora')
             .values('id','id_sisr', 'id_efe_ser_esp',
                     'fecha', 'hora', 'dias_antes', 'plantilla_reco')
         )
 
-        turnos = list(turnos_qs)
-        if not turnos:
-            print("No hay turnos candidatos para recordatorios.")
-            return
-
-        # Filtrar los que realmente correspondan: fecha - dias_antes == hoy
-        candidatos = []
-        for t in turnos:
-            fecha: date = t['fecha']
-            dias_antes = int(t['dias_antes'] or 0)
-            if fecha - timedelta(days=dias_antes) == hoy:
-                candidatos.append(t)
+        with resumen.etapa("candidatos"):
+            candidatos = list(turnos_qs)
 
+        resumen.sumar("candidatos", len(candidatos))
         if not candidatos:
             print("Ningún turno requiere recordatorio hoy.")
             return
@@ -319,15 +581,18 @@ def programar_recordatorios() -> None:
         conn = connections['informix']
         resultados = []
         if turnos_ids:
-            with conn.cursor() as cur:
-                cur.execute(query_detalles_turno(len(turnos_ids)), turnos_ids)
-                resultados = cur.fetchall()
+            with resumen.etapa("informix"), conn.cursor() as cur:
+                resultados = list(fetch_por_lotes(cur, query_detalles_turno, turnos_ids).values())
+        resumen.sumar("detalles", len(resultados))
 
         if not resultados:
             print("No se obtuvieron resultados desde Informix para los turnos solicitados.")
             return
 
         # distribuimos envíos para turnos en días futuros: evitar picos
+        envios = []
+        detalles_snapshot = {}
+        clave_snapshot = snapshot_nuevo()
         per_day_counter = defaultdict(int)
         per_day_batches = {}  # nuevo: guarda offsets por (target_date, batch_index)
         tz = timezone.get_current_timezone()
@@ -427,13 +692,21 @@ def programar_recordatorios() -> None:
                 eta = now + timedelta(seconds=5)
             else:
                 eta = send_dt
-            try:
-                args = list(map(str, r))
-                args.append(str(id))
-                send_reminder_task.apply_async(args=args, eta=eta)
-                print(f"Programado reminder para id_turno={id_turno} en {eta.isoformat()}")
-            except Exception as ex:
-                print(f"[ERROR] al programar send_reminder_task para id_turno={id_turno}: {ex}")
+            envios.append(programados.nuevo(id, timezone.make_naive(eta, tz), clave_snapshot))
+            detalles_snapshot[id] = r
+            print(f"Programado reminder para id_turno={id_turno} en {eta.isoformat()}")
+
+        # una sola escritura: la agenda la despacha despachar_programados
+        try:
+            with resumen.etapa("programar"), atomica():
+                # los detalles, una vez por corrida; viven hasta el último envío más un margen
+                ultimo = max(e.fecha_programada for e in envios) if envios else datetime.now()
+                ttl = int((ultimo - datetime.now()).total_seconds()) + settings.SNAPSHOT_MARGEN
+                guardar_snapshot(clave_snapshot, detalles_snapshot, max(ttl, settings.SNAPSHOT_MARGEN))
+                resumen.sumar("programados", programados.programar(envios))
+        except Exception as ex:
+            print(f"[ERROR] al guardar los envíos programados: {ex}")
+            return
 
         print("Procesamiento de recordatorios completado")
 
@@ -441,22 +714,31 @@ def programar_recordatorios() -> None:
         print(f"Error en recordatorios: {str(e)}")
 
 
-# Usa bind=True para poder llamar self.retry()
+# Recordatorio suelto (no pasa por envio_programado): lo usan la cola de reenvío
+# y las tareas con ETA que ya estén en el broker.
 @shared_task(bind=True, max_retries=20, default_retry_delay=3600)
-def send_reminder_task(
-    self,
-    id_turno,
-    id_efector, id_servicio, id_especialidad,
-    id_efe_ser_esp, tipo_doc, nro_doc,
-    ape_pac, nom_pac, fecha_turno, hora_turno,
-    ape_prof, nom_prof, nombre_servicio, nombre_especialidad,
-    nombre_efector, calle, altura, letra, coordx, coordy,
-    tel_efe, calle_nom, carac_tel, tel, id
-):
+def send_reminder_task(self, *args, reenvios=0):
+    """
+    args = (id, snapshot): id local del Turno y clave del snapshot con sus
+    detalles (src.utils.snapshots). Las tareas encoladas antes de los
+    snapshots traen la fila de detalle completa (25 valores + id) y se
+    aceptan igual.
+    """
+    if len(args) == 26:
+        id, clave = args[25], None
+        datos = dict(zip(CAMPOS_SNAPSHOT, snapshot_de_detalle(args[:25])))
+    else:
+        id, clave = args
+        datos = None
+    id_turno = id
+    # reencolados siempre con la forma corta (sin snapshot se relee de Informix)
+    args_cortos = [id, clave]
+
     # seguridad: inicializar ack
     ack = None
 
     need_retry = False  # bandera para reintentar después del commit
+    reprogramar = 0  # segundos a esperar por el límite de envíos
 
     try:
         with transaction.atomic():
@@ -470,6 +752,7 @@ def send_reminder_task(
             if not turno:
                 print(f"[WARN] Turno {id_turno} no existe.")
                 return
+            id_turno = turno.id_sisr
 
             # Si el turno cambió de estado o ya tiene recordatorio, no enviamos
             if turno.id_estado_id != 1 or turno.msj_recordatorio == 1:
@@ -477,7 +760,7 @@ def send_reminder_task(
                 return
 
             # comprobar si aún corresponde (ej: chequeos de configuración dinámica)
-            send_flag, plantilla = check_turno(id_efe_ser_esp, 4)
+            send_flag, plantilla = check_turno(turno.id_efe_ser_esp_id, 4)
             if not send_flag or not plantilla:
                 print(f"[DEBUG] check_turno returned send={send_flag}, plantilla={plantilla} for turno {id_turno}")
                 return
@@ -486,47 +769,40 @@ def send_reminder_task(
                 print(f"[DEBUG] ya se intento enviar el mensaje y falló, abortando")
                 return
 
+            # detalles del snapshot; si venció, de Informix
+            if datos is None:
+                datos = (hidratar_snapshots([(clave, turno.pk)]).get(turno.pk)
+                         or recargar_snapshots([turno]).get(turno.pk))
+            if datos is None:
+                print(f"[WARN] Sin detalles para id_turno={id_turno}, no se envía recordatorio")
+                return
+
             # validar teléfono
-            if not carac_tel or not tel:
+            carac_tel, tel = datos["carac_tel"], datos["tel"]
+            telefono = telefono_paciente(turno.id_paciente, carac_tel, tel)
+            if not telefono:
                 print(f"[DEBUG] No hay teléfono válido para id_turno={id_turno} (carac={carac_tel}, tel={tel})")
                 try:
-                    create_Mensaje(turno=turno, plantilla=plantilla, estado=-3)
+                    create_Mensaje(None, turno, None, plantilla, -3, None, None)
                 except Exception as ex:
                     print(f"[ERROR] al crear Mensaje para turno {id_turno}: {ex}")
                 return
 
-            telefono = ("549" + str(carac_tel) + str(tel)).replace(" ", "")
-
             # Si existe algun TurnoFlow con Flow en estado 0, marcamos reintento
             if Flow.objects.filter(numero=telefono, id_estado_id=0).exists():
                 print(f"[INFO] Existe TurnoFlow con Flow abierto {id_turno}, reintentando luego.")
                 need_retry = True
+                # el cierre del Flow la reencola antes que el retry de respaldo
+                esperar_flow(telefono, tareas=[args_cortos])
+            # sin dormir: el lock del turno no se retiene esperando cupo, se reencola
+            elif (reprogramar := limitador.turno_envio(espera_max=0)):
+                print(f"[INFO] Límite de envíos: recordatorio de turno {id_turno} reprogramado en {reprogramar:.0f}s")
             else:
-                d_fecha = parse_date(fecha_turno)
-                d_hora = parse_time(hora_turno)
-                d_fecha_str = d_fecha.strftime("%d-%m-%Y")
-                d_hora_str = d_hora.strftime("%H:%M")
-
-                datos_plantilla = {
-                    "nompac": nom_pac or "",
-                    "apepac": ape_pac or "",
-                    "fecha": d_fecha_str,
-                    "horaturno": d_hora_str,
-                    "nomprof": nom_prof or "",
-                    "apeprof": ape_prof or "",
-                    "especialidad": nombre_especialidad or "",
-                    "efector": nombre_efector or "",
-                    "nombre_servicio": nombre_servicio or "",
-                    "calle": calle or "",
-                    "altura": altura or "",
-                    "letra": letra or "",
-                    "coordx": coordx or "",
-                    "coordy": coordy or "",
-                    "tel_efe": tel_efe or "",
-                    "calle_nom": calle_nom or "",
-                }
-
-                mensaje = format_plantilla(plantilla.contenido, datos_plantilla)
+                # dirección y contacto del efector desde la copia local
+                id_efector = datos["id_efector"]
+                ef_row = direcciones_efector([int(id_efector)]).get(int(id_efector)) if id_efector else None
+
+                mensaje = plantillas.render(plantilla, valores_recordatorio(datos, ef_row))
 
                 # enviar_whatsapp puede devolver distintos tipos; proteger acceso
                 try:
@@ -535,9 +811,13 @@ def send_reminder_task(
                     print(f"[ERROR] enviar_whatsapp falló para turno {id_turno}: {ex}")
                     return
 
-                
+                if res.status_code == 503 and encolar_reenvio(
+                        "src.tasks.send_reminder_task", args_cortos, reenvios):
+                    print(f"[WARN] Gateway no disponible: recordatorio de turno {id_turno} en cola de reenvío")
+                    return
 
                 ack = decode_res(res) 
+                registrar_resultado_tel(turno.id_paciente, telefono, ack)
                 response_data = getattr(res, "data", {})
                 try:
                     id_mensaje=response_data.get("id", None)
@@ -556,11 +836,16 @@ def send_reminder_task(
         # if ack >= 0 and not need_retry:
             # create_flow(telefono, turno)
 
+        if reprogramar:
+            send_reminder_task.apply_async(
+                args=args_cortos, kwargs=self.request.kwargs, countdown=reprogramar)
+            return
+
         # si marcamos reintento, lo hacemos **fuera** del atomic y usando el mecanismo de Celery
         if need_retry:
             try:
                 # self.retry lanzará una excepción especial que marca el task como reintentado
-                raise self.retry(exc=Exception("Flow activo, reintentando más tarde"))
+                raise self.retry(args=args_cortos, exc=Exception("Flow activo, reintentando más tarde"))
             except self.MaxRetriesExceededError:
                 print(f"[WARN] Max retries excedidos para turno {id_turno}. No se enviará recordatorio.")
                 return
@@ -1,3 +1,129 @@
-from django.test import TestCase
+from datetime import date
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.db.models import Value
+from django.db.models.sql import Query
+from django.test import SimpleTestCase
+
+from src.models import Turno
+from src.utils import plantillas, telefonos
+from src.utils.querys_informix import CENTINELA, TAMANIOS_IN, lotes_in, tamanio_in
+from src.utils.utils import SumarDias, coalescer_eventos
+
+
+class CoalescerEventosTests(SimpleTestCase):
+    # eventos: (idturno, idpaciente, estado, fecha_hora_mdf, idestadoturno)
+
+    def test_una_transicion_por_turno_en_orden_de_aparicion(self):
+        trs = coalescer_eventos([
+            (2, 20, 2, "t1", 1),
+            (1, 10, 3, "t2", 8),
+            (2, 20, 3, "t3", 8),
+        ])
+        self.assertEqual([(t["idturno"], t["eventos"]) for t in trs], [(2, 2), (1, 1)])
+
+    def test_asignado_y_suspendido_en_la_ventana_no_avisa(self):
+        [tr] = coalescer_eventos([(1, 10, 1, "t1", 3), (1, 10, 2, "t2", 1)])
+        self.assertTrue(tr["crear"])
+        self.assertEqual(tr["estado"], 2)
+        self.assertIsNone(tr["notificar"])
+
+    def test_asignado_y_reprogramado_confirma(self):
+        [tr] = coalescer_eventos([(1, 10, 1, "t1", 3), (1, 10, 3, "t2", 8)])
+        self.assertEqual(tr["notificar"], 1)
+
+    def test_finalizado_no_avisa(self):
+        [tr] = coalescer_eventos([(1, 10, 3, "t1", 8), (1, 10, 4, "t2", 5)])
+        self.assertIsNone(tr["notificar"])
+
+    def test_sin_asignacion_avisa_el_estado_final(self):
+        [tr] = coalescer_eventos([(1, 10, 3, "t1", 8), (1, 10, 3, "t2", 8)])
+        self.assertFalse(tr["crear"])
+        self.assertEqual(tr["notificar"], 3)
+
+    def test_clave_del_aviso_es_el_ultimo_evento(self):
+        [tr] = coalescer_eventos([(1, 10, 3, "t1", 8), (1, 10, 2, "t2", 7)])
+        self.assertEqual((tr["fecha_hora_mdf"], tr["id_estado_turno"]), ("t2", 7))
+
+
+class LotesInTests(SimpleTestCase):
+
+    def test_tamanio_in(self):
+        self.assertEqual(tamanio_in(1), 1)
+        self.assertEqual(tamanio_in(2), 10)
+        self.assertEqual(tamanio_in(10), 10)
+        self.assertEqual(tamanio_in(11), 50)
+        self.assertEqual(tamanio_in(10_000), TAMANIOS_IN[-1])
+
+    def test_sin_ids(self):
+        self.assertEqual(lotes_in([]), [])
+
+    def test_completa_con_centinela(self):
+        [lote] = lotes_in([7, 8, 9])
+        self.assertEqual(len(lote), 10)
+        self.assertEqual(lote[:3], [7, 8, 9])
+        self.assertEqual(set(lote[3:]), {CENTINELA})
+
+    def test_parte_en_bloques_del_tamanio_maximo(self):
+        maximo = TAMANIOS_IN[-1]
+        lotes = lotes_in(range(maximo + 3))
+        self.assertEqual([len(l) for l in lotes], [maximo, 10])
+        self.assertEqual(lotes[1][:3], [maximo, maximo + 1, maximo + 2])
+        self.assertEqual(sum(1 for l in lotes for i in l if i != CENTINELA), maximo + 3)
+
+
+class PlantillasTests(SimpleTestCase):
+
+    def test_compilar(self):
+        self.assertEqual(
+            plantillas.compilar("Hola {nompac}, turno el {fecha}."),
+            ("Hola ", ("nompac",), ", turno el ", ("fecha",), "."),
+        )
+        self.assertEqual(plantillas.compilar("{nompac}{apepac}"), (("nompac",), ("apepac",)))
+        self.assertEqual(plantillas.compilar(""), ())
+        self.assertEqual(plantillas.compilar(None), ())
+
+    def test_desconocidos(self):
+        self.assertEqual(plantillas.desconocidos("{nompac} {fecha}"), set())
+        self.assertEqual(plantillas.desconocidos("{nompac} {dni} {fecha_nac}"), {"dni", "fecha_nac"})
+
+    def test_render(self):
+        p = type("P", (), {"id": None, "contenido": "{nompac} {apepac} {otro}"})()
+        self.assertEqual(plantillas.render(p, {"nompac": "Ana", "apepac": None}), "Ana  {otro}")
+        self.assertEqual(plantillas.render_lote(p, [{"nompac": "A"}, {"nompac": "B"}]),
+                         ["A {apepac} {otro}", "B {apepac} {otro}"])
+
+
+class NormalizarTelefonoTests(SimpleTestCase):
+
+    def test_caracteristica_y_numero(self):
+        self.assertEqual(telefonos.normalizar("341", "6082860"), "5493416082860")
+        self.assertEqual(telefonos.normalizar("0341", "6082860"), "5493416082860")
+        self.assertEqual(telefonos.normalizar("11", "45678901"), "5491145678901")
+
+    def test_quita_el_15(self):
+        self.assertEqual(telefonos.normalizar("0341", "156082860"), "5493416082860")
+
+    def test_limpia_no_digitos(self):
+        self.assertEqual(telefonos.normalizar("(0341)", "608-2860"), "5493416082860")
+
+    def test_numero_completo_sin_caracteristica(self):
+        self.assertEqual(telefonos.normalizar(None, "5493416082860"), "5493416082860")
+
+    def test_invalidos(self):
+        self.assertIsNone(telefonos.normalizar(None, None))
+        self.assertIsNone(telefonos.normalizar("341", "608286"))
+        self.assertIsNone(telefonos.normalizar("3", "608286012"))
+        self.assertIsNone(telefonos.normalizar("", "6082860"))
+
+
+@skipUnless(connection.vendor == "mysql", "SumarDias solo genera SQL de MySQL")
+class SumarDiasTests(SimpleTestCase):
+
+    def test_sql_mysql(self):
+        query = Query(Turno)
+        expresion = SumarDias(Value(date(2026, 2, 27)), Value(3)).resolve_expression(query)
+        sql, params = expresion.as_sql(query.get_compiler(connection=connection), connection)
+        self.assertEqual(sql, "DATE_ADD(%s, INTERVAL %s DAY)")
+        self.assertEqual(params, ["2026-02-27", 3])
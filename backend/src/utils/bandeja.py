@@ -0,0 +1,142 @@
+"""
+Bandeja de salida (outbox) de avisos de turnos.
+
+verificar_turnos escribe cada aviso en bandeja_salida dentro de la misma
+transacción que el cambio de estado del Turno (UnidadDeTrabajo). El
+despachador reclama filas con SELECT ... FOR UPDATE SKIP LOCKED, las marca
+ENVIANDO con un lease de BANDEJA_LEASE segundos y, por cada una, renueva su
+lease, envía y registra Mensaje, flag msj_* y fila HECHO en una sola
+transacción. El valor de fecha_proximo que escribió la corrida es su marca
+de dueño: si el lease venció y otra corrida tomó la fila, la renovación y el
+cierre no la tocan.
+
+Si el proceso muere después de enviar y antes de registrar, el lease vence y
+la fila se vuelve a tomar: la entrega es al menos una vez. La clave única
+del evento de origen (id_turno, fecha_hora_mdf, id_estado_turno) evita
+encolar dos veces el mismo aviso, y el flag msj_* repetir una confirmación o
+cancelación; las reprogramaciones se avisan todas.
+"""
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from src.models import BandejaSalida, Turno, Plantilla
+from .utils import enviar_whatsapp, decode_res, create_Mensaje, CAMPO_MSJ
+from . import limitador, telefonos
+
+REPROGRAMADO = 3
+
+
+def _vence() -> datetime:
+    # DATETIME sin fracción: el lease se compara por igualdad
+    return datetime.now().replace(microsecond=0) + timedelta(seconds=settings.BANDEJA_LEASE)
+
+
+def _propias(filas) -> Q:
+    """Filas que siguen reclamadas por esta corrida (ENVIANDO con el lease que escribió)."""
+    q = Q(pk__in=[])
+    for f in filas:
+        q |= Q(pk=f.pk, fecha_proximo=f.fecha_proximo)
+    return Q(estado=BandejaSalida.ENVIANDO) & q
+
+
+def reclamar(lote: int) -> list[BandejaSalida]:
+    """Toma hasta `lote` filas vencidas; otros despachadores saltean las bloqueadas."""
+    ahora = datetime.now()
+    vence = _vence()
+    with transaction.atomic():
+        filas = list(
+            BandejaSalida.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                estado__in=(BandejaSalida.PENDIENTE, BandejaSalida.ENVIANDO),
+                fecha_proximo__lte=ahora,
+            )
+            .order_by("fecha_proximo", "id")[:lote]
+        )
+        if filas:
+            BandejaSalida.objects.filter(pk__in=[f.pk for f in filas]).update(
+                estado=BandejaSalida.ENVIANDO, fecha_proximo=vence)
+            for f in filas:
+                f.estado, f.fecha_proximo = BandejaSalida.ENVIANDO, vence
+    return filas
+
+
+def _renovar(fila: BandejaSalida) -> bool:
+    """Extiende el lease de la fila antes de enviarla. False si ya no es de esta corrida."""
+    vence = _vence()
+    if not BandejaSalida.objects.filter(_propias([fila])).update(fecha_proximo=vence):
+        return False
+    fila.fecha_proximo = vence
+    return True
+
+
+def _devolver(filas, segundos: float, intento: bool = False) -> None:
+    if not filas:
+        return
+    BandejaSalida.objects.filter(_propias(filas)).update(
+        estado=BandejaSalida.PENDIENTE,
+        fecha_proximo=datetime.now() + timedelta(seconds=segundos),
+        intentos=F("intentos") + (1 if intento else 0),
+    )
+
+
+def _cerrar(fila: BandejaSalida, estado: int) -> None:
+    BandejaSalida.objects.filter(_propias([fila])).update(
+        estado=estado, fecha_envio=datetime.now(), intentos=F("intentos") + 1)
+
+
+def despachar(lote: int) -> dict:
+    filas = reclamar(lote)
+    cuenta = {"reclamados": len(filas), "enviados": 0, "omitidos": 0, "devueltos": 0}
+    if not filas:
+        return cuenta
+
+    turnos = Turno.objects.in_bulk({f.id_turno_id for f in filas})
+    plantillas = Plantilla.objects.in_bulk({f.id_plantilla_id for f in filas})
+
+    for i, f in enumerate(filas):
+        # el lote se envía en serie: cada fila renueva su lease antes de salir
+        if not _renovar(f):
+            print(f"[WARN] Aviso {f.pk} tomado por otra corrida (lease vencido), se saltea")
+            cuenta["omitidos"] += 1
+            continue
+
+        turno = turnos.get(f.id_turno_id)
+        campo = CAMPO_MSJ[f.tipo_aviso]
+        # un turno puede reprogramarse varias veces: cada evento tiene su aviso
+        if turno is None or (f.tipo_aviso != REPROGRAMADO and getattr(turno, campo) == 1):
+            _cerrar(f, BandejaSalida.HECHO)
+            cuenta["omitidos"] += 1
+            continue
+
+        # sin token no se duerme con el lote tomado: el resto vuelve a la bandeja
+        # para cuando haya cupo
+        espera = limitador.reservar(espera_max=0)
+        if espera < 0:
+            _devolver(filas[i:], -espera)
+            cuenta["devueltos"] += len(filas) - i
+            break
+
+        res = enviar_whatsapp(f.numero, f.texto)
+        if res.status_code == 503 and f.intentos + 1 < settings.REENVIO_MAX_INTENTOS:
+            # gateway caído (o circuito abierto): se devuelve el resto con backoff
+            backoff = min(settings.CIRCUITO_ABIERTO_SEG * 2 ** f.intentos, 3600)
+            _devolver(filas[i:i + 1], backoff, intento=True)
+            _devolver(filas[i + 1:], settings.CIRCUITO_ABIERTO_SEG)
+            cuenta["devueltos"] += len(filas) - i
+            print(f"[WARN] Gateway no disponible, bandeja devuelta ({len(filas) - i} avisos)")
+            break
+
+        ack = decode_res(res)
+        telefonos.registrar_resultado(turno.id_paciente, f.numero, ack)
+        data = res.data if isinstance(res.data, dict) else {}
+        with transaction.atomic():
+            create_Mensaje(data.get("id"), turno, f.numero, plantillas.get(f.id_plantilla_id),
+                           ack, data.get("time"), data.get("session"))
+            if ack >= 0:
+                Turno.objects.filter(pk=turno.pk).update(**{campo: 1})
+            _cerrar(f, BandejaSalida.HECHO if ack >= 0 else BandejaSalida.FALLIDO)
+        cuenta["enviados"] += 1
+
+    return cuenta
@@ -0,0 +1,65 @@
+"""
+Caché en memoria del proceso para las tablas de catálogo (Efector, Servicio,
+Especialidad, EfeSerEsp). Se carga completa en la primera consulta, vence a
+los CATALOGO_TTL segundos y se invalida explícitamente desde src.signals
+cuando se guarda o borra alguno de esos modelos; la invalidación llega a los
+demás procesos por la versión en Redis (src.utils.versiones).
+
+Los valores tienen la misma forma que devuelven EfectorSerializer,
+ServicioSerializer, EspecialidadSerializer y EfeSerEspCompletoSerializer.
+"""
+from src.models import Efector, Servicio, Especialidad, EfeSerEsp
+from .versiones import CacheVersionada
+
+
+def _cargar() -> dict:
+    efectores = {
+        pk: {"id": pk, "nombre": nombre}
+        for pk, nombre in Efector.objects.values_list("id", "nombre")
+    }
+    servicios = {
+        pk: {"id": pk, "nombre": nombre}
+        for pk, nombre in Servicio.objects.values_list("id", "nombre")
+    }
+    especialidades = {
+        pk: {"id": pk, "nombre": nombre, "id_servicio": id_servicio}
+        for pk, nombre, id_servicio in Especialidad.objects.values_list("id", "nombre", "id_servicio")
+    }
+    efe_ser_esp = {
+        pk: {
+            "id": pk,
+            "efector": efectores.get(id_efector),
+            "servicio": servicios.get(id_servicio),
+            "especialidad": especialidades.get(id_especialidad),
+        }
+        for pk, id_efector, id_servicio, id_especialidad in EfeSerEsp.objects.values_list(
+            "id", "id_efector", "id_servicio", "id_especialidad")
+    }
+    return {
+        "efectores": efectores,
+        "servicios": servicios,
+        "especialidades": especialidades,
+        "efe_ser_esp": efe_ser_esp,
+    }
+
+
+_cache = CacheVersionada("catalogo", _cargar, "CATALOGO_TTL")
+_catalogo = _cache.datos
+invalidar = _cache.invalidar
+
+
+def efector(pk) -> dict | None:
+    return _catalogo()["efectores"].get(pk)
+
+
+def servicio(pk) -> dict | None:
+    return _catalogo()["servicios"].get(pk)
+
+
+def especialidad(pk) -> dict | None:
+    return _catalogo()["especialidades"].get(pk)
+
+
+def efe_ser_esp(pk) -> dict | None:
+    """EfeSerEsp id -> {"id", "efector", "servicio", "especialidad"} con sus nombres."""
+    return _catalogo()["efe_ser_esp"].get(pk)
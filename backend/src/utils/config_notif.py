@@ -0,0 +1,53 @@
+"""
+Caché en memoria del proceso de la configuración de avisos (EfeSerEspPlantilla)
+por id_efe_ser_esp: banderas por tipo de aviso, dias_antes y las plantillas con
+el contenido ya pasado por emoji.emojize. Se carga completa en la primera
+consulta, vence a los CONFIG_NOTIF_TTL segundos y src.signals la invalida al
+guardar o borrar una configuración o una plantilla; la invalidación llega a
+los demás procesos por la versión en Redis (src.utils.versiones).
+
+Las Plantilla cacheadas se comparten entre llamadas: no deben modificarse.
+"""
+import emoji
+from src.models import EfeSerEspPlantilla
+from .versiones import CacheVersionada
+
+# estado de aviso → (bandera, campo de plantilla); cualquier otro es recordatorio
+TIPOS = {
+    1: ("confirmacion", "plantilla_conf"),
+    2: ("cancelacion", "plantilla_canc"),
+    3: ("reprogramacion", "plantilla_repr"),
+    4: ("recordatorio", "plantilla_reco"),
+}
+
+def _cargar() -> dict:
+    datos = {}
+    qs = (EfeSerEspPlantilla.objects
+          .select_related("plantilla_conf", "plantilla_canc", "plantilla_repr", "plantilla_reco")
+          .order_by("id"))
+    for cfg in qs:
+        # igual que el .first() original: vale la primera fila de cada efe_ser_esp
+        if cfg.id_efe_ser_esp_id in datos:
+            continue
+        banderas, plantillas = {}, {}
+        for estado, (tipo, campo) in TIPOS.items():
+            banderas[estado] = getattr(cfg, tipo) == 1
+            plantilla = getattr(cfg, campo)
+            if plantilla is not None:
+                plantilla.contenido = emoji.emojize(plantilla.contenido)
+            plantillas[estado] = plantilla
+        datos[cfg.id_efe_ser_esp_id] = {
+            "banderas": banderas,
+            "plantillas": plantillas,
+            "dias_antes": cfg.dias_antes,
+        }
+    return datos
+
+
+_cache = CacheVersionada("config_notif", _cargar, "CONFIG_NOTIF_TTL")
+_config = _cache.datos
+invalidar = _cache.invalidar
+
+
+def config(id_efe_ser_esp) -> dict | None:
+    return _config().get(id_efe_ser_esp)
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime
+from celery import current_app
+from django.conf import settings
+from django.db import connections, transaction
+from src.models import Efector, EfectorDireccion
+from .querys_informix import query_efector
+from .utils import fetch_por_lotes
+
+CAMPOS = ["nombre", "calle", "altura", "letra", "coordx", "coordy", "telefono", "calle_nom"]
+
+_pedidos = {}  # id efector sin dirección local -> monotonic hasta el que no se vuelve a pedir
+
+
+def _texto(valor):
+    return None if valor is None else str(valor).strip()
+
+
+def _como_fila(d: EfectorDireccion) -> tuple:
+    # misma forma que las filas de query_efector
+    return (d.id_efector_id, d.nombre, d.calle, d.altura, d.letra,
+            d.coordx, d.coordy, d.telefono, d.calle_nom)
+
+
+def sincronizar(ids=None) -> int:
+    """
+    Copia desde Informix nombre, dirección, coordenadas y teléfono de los
+    efectores (todos los locales si ids es None) a efector_direccion. Solo
+    se copian efectores que existen en la tabla local efector (FK).
+    Devuelve cuántos efectores quedaron actualizados.
+    """
+    efectores = Efector.objects.all()
+    if ids is not None:
+        efectores = efectores.filter(pk__in=ids)
+    ids = list(efectores.values_list("id", flat=True))
+    if not ids:
+        return 0
+
+    with connections['informix'].cursor() as cur:
+        filas = fetch_por_lotes(cur, query_efector, ids)
+
+    ahora = datetime.now()
+    existentes = EfectorDireccion.objects.in_bulk(filas.keys())
+    nuevos, cambiados = [], []
+    for id_efector, fila in filas.items():
+        valores = dict(zip(CAMPOS, map(_texto, fila[1:])))
+        d = existentes.get(id_efector)
+        if d is None:
+            nuevos.append(EfectorDireccion(id_efector_id=id_efector, fecha_sync=ahora, **valores))
+        else:
+            for campo, valor in valores.items():
+                setattr(d, campo, valor)
+            d.fecha_sync = ahora
+            cambiados.append(d)
+
+    with transaction.atomic():
+        EfectorDireccion.objects.bulk_create(nuevos)
+        EfectorDireccion.objects.bulk_update(cambiados, CAMPOS + ["fecha_sync"])
+    return len(filas)
+
+
+def direcciones(ids) -> dict:
+    """
+    {id_efector: fila} con la forma de query_efector, leído solo de la copia
+    local (está en el camino de verificar_turnos). Los que faltan se piden a
+    sincronizar_efectores en segundo plano, a lo sumo una vez cada
+    EFECTORES_REINTENTO_SEG por efector.
+    """
+    ids = {i for i in ids if i is not None}
+    if not ids:
+        return {}
+    resultado = {pk: _como_fila(d) for pk, d in EfectorDireccion.objects.in_bulk(ids).items()}
+    faltantes = ids - resultado.keys()
+    if faltantes:
+        _pedir_sincronizacion(faltantes)
+    return resultado
+
+
+def _pedir_sincronizacion(ids) -> None:
+    ahora = time.monotonic()
+    ids = [i for i in ids if _pedidos.get(i, 0.0) <= ahora]
+    if not ids:
+        return
+    for i in ids:
+        _pedidos[i] = ahora + settings.EFECTORES_REINTENTO_SEG
+    # los que no están en efector no se pueden copiar (FK): no se piden
+    locales = list(Efector.objects.filter(pk__in=ids).values_list("id", flat=True))
+    if not locales:
+        return
+    try:
+        current_app.send_task("src.tasks.sincronizar_efectores", args=[locales])
+    except Exception as ex:
+        print(f"[WARN] no se pudo pedir la sincronización de efectores {locales}: {ex}")
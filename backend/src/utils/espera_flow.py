@@ -0,0 +1,95 @@
+"""
+Lista de espera de recordatorios frenados por un Flow abierto.
+
+Cuando el número del paciente tiene un Flow en curso, el recordatorio se
+posterga (envío programado devuelto con PROGRAMADOS_FLOW_ESPERA, o
+send_reminder_task con self.retry) y además se anota en un set de Redis por
+número. listen.py, al recibir flow_finished/error, llama a liberar_flow():
+los envíos programados vuelven a vencer en el momento y las tareas se
+reencolan, así el recordatorio sale apenas termina la conversación. La
+espera larga queda solo como respaldo para los Flow que nunca terminan.
+
+Miembros del set: "p:<id envio_programado>" o "t:<id turno>:<snapshot>".
+"""
+from datetime import datetime
+from celery import current_app
+from django.conf import settings
+from redis.exceptions import RedisError
+from src.models import EnvioProgramado, Flow
+from .redis_client import get_redis
+
+PREFIJO = "notificaciones:espera_flow:"
+
+
+def _clave(numero: str) -> str:
+    return PREFIJO + numero
+
+
+def _flow_abierto(numero: str) -> bool:
+    return Flow.objects.filter(numero=numero, id_estado_id=0).exists()
+
+
+def esperar(numero: str, programados=(), tareas=()) -> None:
+    """
+    Anota envíos programados (ids) y/o tareas ((id turno, snapshot)) a la
+    espera del Flow de `numero`. Si el Flow cerró mientras tanto, libera.
+    """
+    miembros = [f"p:{pk}" for pk in programados]
+    miembros += [f"t:{id}:{snapshot or ''}" for id, snapshot in tareas]
+    if not miembros:
+        return
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.sadd(_clave(numero), *miembros)
+        # no sobrevive a la espera de respaldo completa
+        pipe.expire(_clave(numero), settings.PROGRAMADOS_FLOW_ESPERA * settings.PROGRAMADOS_FLOW_REINTENTOS)
+        pipe.execute()
+    except RedisError as ex:
+        print(f"[WARN] no se pudo anotar la espera de Flow de {numero}: {ex}")
+        return
+    # el cierre pudo llegar entre la consulta del llamador y el SADD
+    if not _flow_abierto(numero):
+        liberar(numero)
+
+
+def liberar(numero: str) -> int:
+    """Suelta lo que espera por `numero` si ya no tiene Flow abierto."""
+    if _flow_abierto(numero):
+        return 0
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.smembers(_clave(numero))
+        pipe.delete(_clave(numero))
+        miembros, _ = pipe.execute()
+    except RedisError as ex:
+        print(f"[WARN] no se pudo liberar la espera de Flow de {numero}: {ex}")
+        return 0
+
+    programados, tareas = [], []
+    for m in miembros:
+        m = m.decode() if isinstance(m, bytes) else m
+        tipo, _, resto = m.partition(":")
+        if tipo == "p":
+            programados.append(int(resto))
+        elif tipo == "t":
+            id, _, snapshot = resto.partition(":")
+            tareas.append((int(id), snapshot or None))
+
+    if programados:
+        # vuelven a vencer ya; despachar_programados los toma en el próximo tick
+        EnvioProgramado.objects.filter(
+            pk__in=programados, estado=EnvioProgramado.PENDIENTE,
+        ).update(fecha_programada=datetime.now())
+    for id, snapshot in tareas:
+        current_app.send_task("src.tasks.send_reminder_task", args=[id, snapshot])
+    return len(programados) + len(tareas)
+
+
+def liberar_flow(id_flow) -> int:
+    """Entrada desde listen.py con el pk del Flow que terminó."""
+    numero = Flow.objects.filter(pk=id_flow).values_list("numero", flat=True).first()
+    if not numero:
+        return 0
+    return liberar(numero)
@@ -0,0 +1,142 @@
+"""
+Estado (ack) de los mensajes enviados.
+
+La vía principal son los callbacks del gateway que recibe listen.py y se
+aplican por lotes con aplicar_acks, que marca fecha_callback. Como respaldo,
+los Mensaje en estado 0-2 que nunca recibieron un callback y pasaron
+ESTADOS_ESPERA_CALLBACK minutos se consultan a API_ESTADO_WHATSAPP por lotes. La frecuencia baja a medida que el mensaje
+envejece (ver INTERVALOS) y después de ESTADOS_MAX_HORAS se deja de
+consultar. fecha_last_ack marca el último ack recibido y
+fecha_ultima_consulta el último polling, haya respondido o no la API.
+"""
+from datetime import timedelta
+from decouple import config
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import now
+import time
+import requests
+from src.models import Mensaje
+from . import gateway
+
+PENDIENTES = (0, 1, 2)
+
+# (edad máxima del mensaje, intervalo entre consultas)
+INTERVALOS = (
+    (timedelta(minutes=10), timedelta(minutes=1)),
+    (timedelta(hours=1), timedelta(minutes=5)),
+    (timedelta(hours=6), timedelta(minutes=15)),
+    (timedelta(hours=24), timedelta(hours=1)),
+    (None, timedelta(hours=6)),
+)
+
+
+def consultar_estado(mensaje: Mensaje) -> int | None:
+    """Ack informado por la API para el mensaje, o None si no hubo respuesta útil."""
+    params = {
+        "session": mensaje.id_sesion_id,
+        "numero": mensaje.numero,
+        "id": mensaje.id_mensaje
+    }
+    try:
+        resp = gateway.get(
+            config("API_ESTADO_WHATSAPP"),
+            lectura=5,
+            params=params,
+            headers={"Accept": "application/json"},
+        )
+        if "application/json" not in resp.headers.get("Content-Type", ""):
+            return None
+        data = resp.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    if isinstance(data, dict) and "ack" in data:
+        return int(data["ack"])
+    return None
+
+
+def _vencidos(ahora) -> Q:
+    """Mensajes cuya última consulta es más vieja que el intervalo de su franja de edad."""
+    q = Q()
+    desde = ahora
+    for edad, intervalo in INTERVALOS:
+        franja = Q(fecha_envio__lte=desde)
+        if edad is not None:
+            franja &= Q(fecha_envio__gt=ahora - edad)
+            desde = ahora - edad
+        franja &= Q(fecha_ultima_consulta__isnull=True) | Q(fecha_ultima_consulta__lte=ahora - intervalo)
+        q |= franja
+    return q
+
+
+def refrescar_pendientes(lote: int, renovar=None) -> tuple[int, int]:
+    """
+    Consulta un lote de mensajes pendientes que ya toca revisar y guarda los
+    resultados con un bulk_update. Corta al pasar ESTADOS_PRESUPUESTO_SEG
+    (lo no consultado queda para el próximo tick); `renovar` se llama después
+    de cada consulta (heartbeat del lock) y si devuelve False se corta.
+    Devuelve (consultados, actualizados).
+    """
+    ahora = now()
+    mensajes = list(
+        Mensaje.objects
+        .filter(
+            id_estado_id__in=PENDIENTES,
+            id_mensaje__isnull=False,
+            fecha_callback__isnull=True,  # con callbacks el polling sobra
+            fecha_envio__gt=ahora - timedelta(hours=settings.ESTADOS_MAX_HORAS),
+            fecha_envio__lte=ahora - timedelta(minutes=settings.ESTADOS_ESPERA_CALLBACK),
+        )
+        .filter(_vencidos(ahora))
+        .order_by("fecha_ultima_consulta", "fecha_envio")[:lote]
+    )
+
+    limite = time.monotonic() + settings.ESTADOS_PRESUPUESTO_SEG
+    consultados, cambiados = [], 0
+    for m in mensajes:
+        if time.monotonic() >= limite:
+            break
+        ack = consultar_estado(m)
+        # el intento cuenta aunque no haya respuesta: vuelve al final de la fila
+        m.fecha_ultima_consulta = now()
+        consultados.append(m)
+        if ack is not None:
+            m.id_estado_id = ack
+            m.fecha_last_ack = m.fecha_ultima_consulta
+            cambiados += 1
+        if renovar is not None and not renovar():
+            break
+
+    Mensaje.objects.bulk_update(consultados, ["id_estado", "fecha_last_ack", "fecha_ultima_consulta"])
+    return len(consultados), cambiados
+
+
+def aplicar_acks(acks: dict) -> int:
+    """
+    Aplica en bloque los acks recibidos por callback.
+    acks: {(id_mensaje, sesion): (ack, fecha)}; sesion None vale para cualquiera.
+    Un ack no hace retroceder el estado, salvo los negativos (error informado
+    por el gateway). Todo Mensaje con callback queda marcado en fecha_callback
+    aunque el ack no cambie su estado. Devuelve cuántos Mensaje se actualizaron.
+    """
+    if not acks:
+        return 0
+    mensajes = Mensaje.objects.filter(id_mensaje__in={id_mensaje for id_mensaje, _ in acks})
+    tocados, cambiados = [], 0
+    for m in mensajes:
+        valor = acks.get((m.id_mensaje, m.id_sesion_id)) or acks.get((m.id_mensaje, None))
+        if valor is None:
+            continue
+        ack, fecha = valor
+        avanza = not (ack == m.id_estado_id or (0 <= ack < m.id_estado_id))
+        if not avanza and m.fecha_callback is not None:
+            continue
+        if m.fecha_callback is None:
+            m.fecha_callback = now()
+        if avanza:
+            m.id_estado_id = ack
+            m.fecha_last_ack = fecha or now()
+            cambiados += 1
+        tocados.append(m)
+    Mensaje.objects.bulk_update(tocados, ["id_estado", "fecha_last_ack", "fecha_callback"])
+    return cambiados
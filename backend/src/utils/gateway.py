@@ -0,0 +1,191 @@
+"""
+Cliente HTTP compartido para la API de WhatsApp (envío, estado y flows).
+
+Mantiene un requests.Session por hilo con un pool de conexiones keep-alive
+de GATEWAY_POOL conexiones, timeouts separados de conexión y lectura, y
+reintentos con backoff exponencial con jitter ante 5xx. Las sesiones se
+descartan después de un fork (hijos prefork de Celery, workers de gunicorn)
+para no compartir sockets heredados entre procesos.
+
+Un circuit breaker compartido en Redis corta las llamadas cuando el gateway
+acumula CIRCUITO_UMBRAL fallas (errores de conexión, timeouts o 5xx) dentro
+de CIRCUITO_VENTANA segundos: mientras está abierto las llamadas fallan al
+instante con CircuitoAbierto. Al vencer CIRCUITO_ABIERTO_SEG deja pasar una
+sola prueba (medio abierto); si responde se cierra y se dispara
+drenar_reenvios, si no vuelve a abrirse.
+"""
+import os
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from celery import current_app
+from django.conf import settings
+from redis.exceptions import RedisError
+from .redis_client import get_redis
+
+_local = threading.local()
+
+
+class _Reintento(Retry):
+    """
+    Los GET se reintentan ante cualquier 5xx de la lista. Un POST solo ante 503
+    (el gateway no lo tomó); con otro 5xx o error de lectura el mensaje pudo
+    haber salido y reintentarlo lo duplicaría. Los errores de conexión se
+    reintentan siempre.
+    """
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST":
+            return bool(self.total) and status_code == 503
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_backoff_time(self):
+        # jitter propio: backoff_jitter recién existe en urllib3 2.x (requirements fija 1.26)
+        espera = super().get_backoff_time()
+        if espera <= 0:
+            return espera
+        return espera + random.uniform(0, settings.GATEWAY_BACKOFF)
+
+
+def _crear_sesion() -> requests.Session:
+    reintentos = _Reintento(
+        total=settings.GATEWAY_REINTENTOS,
+        read=settings.GATEWAY_REINTENTOS,
+        connect=settings.GATEWAY_REINTENTOS,
+        status_forcelist=(500, 502, 503, 504),
+        backoff_factor=settings.GATEWAY_BACKOFF,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=settings.GATEWAY_POOL,
+        max_retries=reintentos,
+    )
+    s = requests.Session()
+    s.trust_env = False  # sin proxies del entorno
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def sesion() -> requests.Session:
+    s = getattr(_local, "sesion", None)
+    if s is None or _local.pid != os.getpid():
+        s = _crear_sesion()
+        _local.sesion = s
+        _local.pid = os.getpid()
+    return s
+
+
+class CircuitoAbierto(requests.exceptions.ConnectionError):
+    """El circuito está abierto: la llamada no se hizo."""
+
+
+class Circuito:
+    PREFIJO = "notificaciones:circuito"
+
+    def _key(self, sufijo: str) -> str:
+        return f"{self.PREFIJO}:{sufijo}"
+
+    def permitir(self) -> bool:
+        """False si está abierto, o medio abierto con la prueba ya tomada por otro."""
+        try:
+            r = get_redis()
+            if r.exists(self._key("abierto")):
+                return False
+            if r.exists(self._key("medio")):
+                return bool(r.set(self._key("prueba"), 1, nx=True, ex=settings.CIRCUITO_ABIERTO_SEG))
+            return True
+        except RedisError:
+            return True
+
+    def exito(self) -> None:
+        try:
+            r = get_redis()
+            pipe = r.pipeline()
+            pipe.delete(self._key("fallas"))
+            pipe.delete(self._key("medio"))
+            pipe.delete(self._key("prueba"))
+            pipe.delete(self._key("sonda"))
+            _, estaba_medio, _, _ = pipe.execute()
+        except RedisError:
+            return
+        if estaba_medio:
+            print("[INFO] Gateway de WhatsApp disponible otra vez, circuito cerrado")
+            current_app.send_task("src.tasks.drenar_reenvios")
+
+    def falla(self) -> None:
+        try:
+            r = get_redis()
+            if r.exists(self._key("medio")):
+                self._abrir(r)
+                return
+            pipe = r.pipeline()
+            pipe.incr(self._key("fallas"))
+            pipe.expire(self._key("fallas"), settings.CIRCUITO_VENTANA)
+            fallas, _ = pipe.execute()
+            if fallas >= settings.CIRCUITO_UMBRAL:
+                self._abrir(r)
+        except RedisError:
+            pass
+
+    def _abrir(self, r) -> None:
+        pipe = r.pipeline()
+        pipe.set(self._key("abierto"), 1, ex=settings.CIRCUITO_ABIERTO_SEG)
+        pipe.set(self._key("medio"), 1)
+        pipe.delete(self._key("prueba"))
+        pipe.delete(self._key("sonda"))
+        pipe.delete(self._key("fallas"))
+        pipe.execute()
+        print(f"[WARN] Gateway de WhatsApp sin respuesta, circuito abierto por {settings.CIRCUITO_ABIERTO_SEG}s")
+
+    def cerrado(self) -> bool:
+        try:
+            return not get_redis().exists(self._key("medio"))
+        except RedisError:
+            return True
+
+    def tomar_sonda(self) -> bool:
+        """
+        True para un solo llamador cuando está medio abierto (vencido el
+        abierto): deja salir una tarea que haga de prueba aunque no haya
+        tráfico. Vence a los CIRCUITO_ABIERTO_SEG si la prueba no llegó a correr.
+        """
+        try:
+            r = get_redis()
+            if r.exists(self._key("abierto")) or not r.exists(self._key("medio")):
+                return False
+            return bool(r.set(self._key("sonda"), 1, nx=True, ex=settings.CIRCUITO_ABIERTO_SEG))
+        except RedisError:
+            return False
+
+
+circuito = Circuito()
+
+
+def _llamar(metodo: str, url: str, lectura, kwargs) -> requests.Response:
+    if not circuito.permitir():
+        raise CircuitoAbierto("circuito abierto hacia el gateway de WhatsApp")
+    try:
+        resp = sesion().request(metodo, url, timeout=_timeout(lectura), **kwargs)
+    except requests.exceptions.RequestException:
+        circuito.falla()
+        raise
+    if resp.status_code >= 500:
+        circuito.falla()
+    else:
+        circuito.exito()
+    return resp
+
+
+def _timeout(lectura=None) -> tuple:
+    return (settings.GATEWAY_CONNECT_TIMEOUT, lectura or settings.GATEWAY_READ_TIMEOUT)
+
+
+def get(url: str, lectura: float | None = None, **kwargs) -> requests.Response:
+    return _llamar("GET", url, lectura, kwargs)
+
+
+def post(url: str, lectura: float | None = None, **kwargs) -> requests.Response:
+    return _llamar("POST", url, lectura, kwargs)
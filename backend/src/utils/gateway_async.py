@@ -0,0 +1,127 @@
+"""
+Cliente asyncio (aiohttp) de la API de WhatsApp para envíos en ráfaga.
+
+enviar_lote recibe pares (numero, texto), los manda con hasta
+GATEWAY_CONCURRENCIA requests en vuelo sobre una única sesión keep-alive y
+devuelve, en el mismo orden, (status, ack, data) con la misma semántica que
+decode_res sobre la respuesta de enviar_whatsapp. Los reintentos siguen la
+política de gateway.py: solo ante 503 o error de conexión. 503 queda para
+lo que seguro no salió (conexión, reintentos agotados, circuito abierto);
+un error de lectura devuelve 504 porque el mensaje pudo haber salido. El lote respeta
+el circuit breaker de gateway.py: con el circuito abierto no sale nada y
+medio abierto sale primero un request de prueba y el resto solo si pasa.
+"""
+import asyncio
+import random
+import aiohttp
+from decouple import config
+from django.conf import settings
+from rest_framework.response import Response
+from rest_framework import status
+from .utils import decode_res
+from .gateway import circuito, CircuitoAbierto
+from . import simulacion
+
+
+class _Reintentar(Exception):
+    pass
+
+
+def _sin_conexion(e) -> Response:
+    return Response(
+        {"error": "No se pudo conectar con la API WhatsApp", "detail": str(e)},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+def _sin_respuesta(e) -> Response:
+    return Response(
+        {"error": "Sin respuesta de la API WhatsApp", "detail": str(e)},
+        status=status.HTTP_504_GATEWAY_TIMEOUT
+    )
+
+
+async def _enviar_uno(sesion, sem, url, numero, texto) -> Response:
+    intento = 0
+    while True:
+        try:
+            async with sem:
+                async with sesion.post(url, json={"numero": numero, "texto": texto},
+                                       headers={"Accept": "application/json"}) as resp:
+                    if resp.status == 503 and intento < settings.GATEWAY_REINTENTOS:
+                        raise _Reintentar()
+                    if "application/json" in resp.headers.get("Content-Type", ""):
+                        return Response(await resp.json(), status=resp.status)
+                    texto_resp = await resp.text()
+                    return Response(
+                        {
+                            "error": "Respuesta no JSON desde la API WhatsApp",
+                            "status_code": resp.status,
+                            "raw_response": texto_resp[:500]
+                        },
+                        status=status.HTTP_502_BAD_GATEWAY
+                    )
+        except (_Reintentar, aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError) as e:
+            if intento >= settings.GATEWAY_REINTENTOS:
+                return _sin_conexion(e)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # error de lectura: el mensaje pudo haber salido, no se reintenta ni se reenvía
+            return _sin_respuesta(e)
+        espera = settings.GATEWAY_BACKOFF * (2 ** intento)
+        await asyncio.sleep(espera + random.uniform(0, settings.GATEWAY_BACKOFF))
+        intento += 1
+
+
+def _registrar(respuestas) -> None:
+    """Informa al circuit breaker el resultado de un grupo de requests."""
+    fallas = sum(1 for r in respuestas if r.status_code >= 500)
+    for _ in range(min(fallas, settings.CIRCUITO_UMBRAL)):
+        circuito.falla()
+    if fallas < len(respuestas):
+        circuito.exito()
+
+
+async def enviar_lote_async(pares, concurrencia: int | None = None) -> list[tuple[int, int, dict]]:
+    pares = list(pares)
+    if not pares:
+        return []
+    rechazo = _sin_conexion(CircuitoAbierto("circuito abierto hacia el gateway de WhatsApp"))
+    # medio abierto: permitir() da una sola prueba, que sale sola
+    prueba = not circuito.cerrado()
+    if not circuito.permitir():
+        return [(rechazo.status_code, decode_res(rechazo), rechazo.data) for _ in pares]
+    concurrencia = concurrencia or settings.GATEWAY_CONCURRENCIA
+    url = config("API_WHATSAPP")
+    sem = asyncio.Semaphore(concurrencia)
+    conector = aiohttp.TCPConnector(limit=concurrencia)
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=settings.GATEWAY_CONNECT_TIMEOUT,
+        sock_read=settings.GATEWAY_READ_TIMEOUT,
+    )
+    async with aiohttp.ClientSession(connector=conector, timeout=timeout) as sesion:
+        respuestas = []
+        if prueba:
+            numero, texto = pares[0]
+            respuestas.append(await _enviar_uno(sesion, sem, url, numero, texto))
+            _registrar(respuestas)
+            if respuestas[0].status_code >= 500:
+                respuestas += [rechazo] * (len(pares) - 1)
+                pares = []
+            else:
+                pares = pares[1:]
+        if pares:
+            resto = await asyncio.gather(
+                *(_enviar_uno(sesion, sem, url, numero, texto) for numero, texto in pares))
+            _registrar(resto)
+            respuestas += resto
+    return [(r.status_code, decode_res(r), r.data if isinstance(r.data, dict) else {}) for r in respuestas]
+
+
+def enviar_lote(pares, concurrencia: int | None = None) -> list[tuple[int, int, dict]]:
+    """Entrada síncrona (tasks de Celery): corre el lote en un loop propio."""
+    pares = list(pares)
+    if not pares:
+        return []
+    if simulacion.activa():
+        return [(200, 1, simulacion.registrar_envio(numero, texto).data) for numero, texto in pares]
+    return asyncio.run(enviar_lote_async(pares, concurrencia))
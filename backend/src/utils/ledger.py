@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from src.models import EventoProcesado
+
+PODA_LOTE = 5000
+
+
+def clave_evento(idturno, fecha_hora_mdf, idestadoturno) -> tuple:
+    return (int(idturno), str(fecha_hora_mdf), int(idestadoturno))
+
+
+def ya_procesados(filas) -> set:
+    """
+    Devuelve las claves (idturno, fecha_hora_mdf, idestadoturno) de las filas
+    de turnoshistorico que ya figuran en el registro. Una consulta por página.
+    """
+    claves = {clave_evento(idturno, fecha, idestado) for idturno, _, idestado, fecha in filas}
+    if not claves:
+        return set()
+    existentes = (
+        EventoProcesado.objects
+        .filter(
+            id_turno__in={c[0] for c in claves},
+            fecha_hora_mdf__gte=min(c[1] for c in claves),
+        )
+        .values_list("id_turno", "fecha_hora_mdf", "id_estado_turno")
+    )
+    return claves & set(existentes)
+
+
+def nuevos_registros(claves) -> list[EventoProcesado]:
+    ahora = datetime.now()
+    return [
+        EventoProcesado(id_turno=idturno, fecha_hora_mdf=fecha, id_estado_turno=idestado, fecha_registro=ahora)
+        for idturno, fecha, idestado in claves
+    ]
+
+
+def podar(dias: int) -> int:
+    """Borra por lotes los registros más viejos que `dias`. Devuelve cuántos borró."""
+    limite = datetime.now() - timedelta(days=dias)
+    total = 0
+    while True:
+        ids = list(
+            EventoProcesado.objects
+            .filter(fecha_registro__lt=limite)
+            .values_list("id", flat=True)[:PODA_LOTE]
+        )
+        if not ids:
+            return total
+        total += EventoProcesado.objects.filter(id__in=ids).delete()[0]
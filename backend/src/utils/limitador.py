@@ -0,0 +1,79 @@
+"""
+Limitador de envíos tipo token bucket en Redis, compartido por todos los
+workers de Celery y el proceso web. Hay un balde por Sesion de WhatsApp con
+capacidad LIMITE_RAFAGA que se recarga a LIMITE_TASA mensajes por segundo.
+
+El gateway elige la sesión al enviar, así que los envíos toman del balde de
+settings.WHATSAPP_SESION.
+
+reservar() descuenta el token aunque todavía no esté disponible (el balde
+queda en negativo) y devuelve cuánto hay que esperar; si la espera supera
+el máximo indicado no reserva nada y la devuelve en negativo, para que el
+llamador reprograme el envío.
+"""
+import time
+from django.conf import settings
+from redis.exceptions import RedisError
+from .redis_client import get_redis
+
+PREFIJO = "notificaciones:limite"
+
+_LUA = """
+local rafaga = tonumber(ARGV[1])
+local tasa = tonumber(ARGV[2])
+local maximo = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local ahora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local datos = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(datos[1]) or rafaga
+local ts = tonumber(datos[2]) or ahora
+tokens = math.min(rafaga, tokens + (ahora - ts) * tasa)
+local espera = 0
+if tokens < 1 then
+    espera = (1 - tokens) / tasa
+    if espera > maximo then
+        return tostring(-espera)
+    end
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(ahora))
+redis.call('EXPIRE', KEYS[1], math.ceil(rafaga / tasa) + 60)
+return tostring(espera)
+"""
+
+_script = None
+
+
+def reservar(sesion: str | None = None, espera_max: float | None = None) -> float:
+    """
+    Reserva un envío en el balde de la sesión. Devuelve los segundos a esperar
+    antes de enviar (0 si hay token), o un valor negativo si la espera
+    superaría espera_max y no se reservó. Sin Redis no limita.
+    """
+    global _script
+    sesion = sesion or settings.WHATSAPP_SESION
+    if espera_max is None:
+        espera_max = settings.LIMITE_ESPERA_MAX
+    try:
+        if _script is None:
+            _script = get_redis().register_script(_LUA)
+        return float(_script(
+            keys=[f"{PREFIJO}:{sesion}"],
+            args=[settings.LIMITE_RAFAGA, settings.LIMITE_TASA, espera_max],
+            client=get_redis(),
+        ))
+    except RedisError as ex:
+        print(f"[WARN] limitador sin Redis, se envía sin limitar: {ex}")
+        return 0.0
+
+
+def turno_envio(sesion: str | None = None, espera_max: float | None = None) -> float:
+    """
+    Espera (dormido) el turno de envío si es corto. Devuelve 0 si ya se puede
+    enviar, o los segundos tras los que conviene reprogramar.
+    """
+    espera = reservar(sesion, espera_max)
+    if espera < 0:
+        return -espera
+    if espera > 0:
+        time.sleep(espera)
+    return 0.0
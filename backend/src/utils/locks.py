@@ -0,0 +1,60 @@
+from redis.exceptions import LockError
+from .redis_client import get_redis
+
+PREFIJO = "notificaciones:lock"
+
+
+class PollLock:
+    """
+    Lock distribuido (Redis) con lease para tareas periódicas de una sola
+    instancia. El dueño renueva el lease con renovar(); si el proceso muere el
+    lock vence solo. Los ticks que encuentran el lock tomado se cuentan y dejan
+    una marca para que el dueño haga una pasada más en lugar de correr en paralelo.
+    """
+
+    def __init__(self, nombre: str, lease: int):
+        self.nombre = nombre
+        self.redis = get_redis()
+        self.lock = self.redis.lock(f"{PREFIJO}:{nombre}", timeout=lease, blocking=False)
+
+    def _key(self, sufijo: str) -> str:
+        return f"{PREFIJO}:{self.nombre}:{sufijo}"
+
+    def adquirir(self) -> bool:
+        return self.lock.acquire(blocking=False)
+
+    def renovar(self) -> bool:
+        """Heartbeat: vuelve el lease a su duración completa. False si se perdió el lock."""
+        try:
+            self.lock.reacquire()
+            return True
+        except LockError:
+            return False
+
+    def liberar(self) -> None:
+        try:
+            self.lock.release()
+        except LockError:
+            pass
+
+    def registrar_salto(self) -> int:
+        """Cuenta un tick salteado y pide al dueño una pasada extra."""
+        pipe = self.redis.pipeline()
+        pipe.incr(self._key("saltados"))
+        pipe.set(self._key("pendiente"), 1)
+        saltados, _ = pipe.execute()
+        return saltados
+
+    def tomar_pendiente(self) -> bool:
+        """True si algún tick se salteó mientras corría el dueño (y limpia la marca)."""
+        pipe = self.redis.pipeline()
+        pipe.get(self._key("pendiente"))
+        pipe.delete(self._key("pendiente"))
+        pendiente, _ = pipe.execute()
+        if pendiente:
+            self.redis.incr(self._key("fusionados"))
+        return bool(pendiente)
+
+    def contadores(self) -> dict:
+        saltados, fusionados = self.redis.mget(self._key("saltados"), self._key("fusionados"))
+        return {"saltados": int(saltados or 0), "fusionados": int(fusionados or 0)}
@@ -0,0 +1,81 @@
+"""
+Compilador de plantillas de mensajes. Cada Plantilla.contenido se parte una
+sola vez en segmentos literales y placeholders ({nompac}, {fecha}, ...); el
+resultado se guarda en memoria del proceso por id de plantilla y hash del
+contenido, así que editar una plantilla recompila sola en el próximo uso.
+
+Render: un placeholder con valor None queda vacío, uno que no viene en los
+valores se deja tal cual ({clave}), igual que el format_plantilla anterior.
+"""
+import re
+import threading
+
+_PATRON = re.compile(r'{(\w+)}')
+
+# placeholders que completan verificar_turnos y send_reminder_task
+PLACEHOLDERS = frozenset({
+    "nompac", "apepac", "fecha", "horaturno", "nomprof", "apeprof",
+    "especialidad", "efector", "servicio", "nombre_servicio",
+    "calle", "altura", "letra", "coordx", "coordy", "tel_efe", "calle_nom",
+})
+
+_lock = threading.Lock()
+_compiladas = {}  # id plantilla -> (hash contenido, segmentos)
+
+
+def compilar(contenido: str) -> tuple:
+    """
+    Devuelve los segmentos de la plantilla: str para texto literal y
+    (clave,) para cada placeholder.
+    """
+    segmentos = []
+    pos = 0
+    for m in _PATRON.finditer(contenido or ""):
+        if m.start() > pos:
+            segmentos.append(contenido[pos:m.start()])
+        segmentos.append((m.group(1),))
+        pos = m.end()
+    if pos < len(contenido or ""):
+        segmentos.append(contenido[pos:])
+    return tuple(segmentos)
+
+
+def desconocidos(contenido: str) -> set:
+    """Placeholders de la plantilla que ningún envío completa."""
+    return {s[0] for s in compilar(contenido) if isinstance(s, tuple)} - PLACEHOLDERS
+
+
+def _segmentos(plantilla) -> tuple:
+    contenido = plantilla.contenido or ""
+    h = hash(contenido)
+    cache = _compiladas.get(plantilla.id)
+    if cache is not None and cache[0] == h:
+        return cache[1]
+    segmentos = compilar(contenido)
+    if plantilla.id is not None:
+        with _lock:
+            _compiladas[plantilla.id] = (h, segmentos)
+    return segmentos
+
+
+def _unir(segmentos: tuple, valores: dict) -> str:
+    partes = []
+    for s in segmentos:
+        if isinstance(s, str):
+            partes.append(s)
+        elif s[0] in valores:
+            v = valores[s[0]]
+            partes.append("" if v is None else str(v))
+        else:
+            partes.append("{" + s[0] + "}")
+    return "".join(partes)
+
+
+def render(plantilla, valores: dict) -> str:
+    return _unir(_segmentos(plantilla), valores)
+
+
+def render_lote(plantilla, lote) -> list[str]:
+    """Renderiza la misma plantilla para una lista de dicts de valores."""
+    segmentos = _segmentos(plantilla)
+    return [_unir(segmentos, valores) for valores in lote]
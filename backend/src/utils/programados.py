@@ -0,0 +1,304 @@
+"""
+Envíos programados (recordatorios) en la tabla envio_programado.
+
+programar_recordatorios deja una fila por turno con su fecha_programada y la
+clave del snapshot de detalles (src.utils.snapshots); despachar_programados
+corre cada pocos segundos, reclama las vencidas con SELECT ... FOR UPDATE
+SKIP LOCKED, hidrata y revalida en bloque y envía con gateway_async solo las
+que consiguieron cupo del limitador, en una sola ráfaga. El lease cubre el
+doble del peor caso de esa ráfaga y fecha_programada con el lease escrito
+es la marca de dueño de la corrida. Un turno que deja de estar asignado se
+cancela con un UPDATE (UnidadDeTrabajo.flush), sin tareas ETA en memoria de
+los workers.
+"""
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from src.models import EnvioProgramado, Turno, Mensaje, Flow
+from .utils import check_turno, create_Mensaje
+from .gateway_async import enviar_lote
+from .efectores import direcciones
+from .parse import parse_date, parse_time
+from . import limitador, plantillas, telefonos, snapshots, espera_flow
+
+RECORDATORIO = 4
+
+
+def nuevo(turno_id: int, fecha: datetime, snapshot: str) -> EnvioProgramado:
+    ahora = datetime.now()
+    return EnvioProgramado(
+        id_turno_id=turno_id,
+        tipo_aviso=RECORDATORIO,
+        fecha_programada=fecha,
+        estado=EnvioProgramado.PENDIENTE,
+        intentos=0,
+        snapshot=snapshot,
+        fecha_alta=ahora,
+    )
+
+
+def programar(envios: list[EnvioProgramado]) -> int:
+    """
+    Guarda los envíos; los ya programados no se duplican (id_turno, tipo_aviso)
+    y los que habían sido cancelados vuelven a quedar pendientes.
+    """
+    if not envios:
+        return 0
+    with transaction.atomic():
+        EnvioProgramado.objects.bulk_create(envios, ignore_conflicts=True)
+        por_turno = {e.id_turno_id: e for e in envios}
+        cancelados = list(EnvioProgramado.objects.filter(
+            id_turno__in=por_turno, tipo_aviso=RECORDATORIO, estado=EnvioProgramado.CANCELADO))
+        for c in cancelados:
+            e = por_turno[c.id_turno_id]
+            c.estado, c.intentos = EnvioProgramado.PENDIENTE, 0
+            c.fecha_programada, c.snapshot = e.fecha_programada, e.snapshot
+        EnvioProgramado.objects.bulk_update(cancelados, ["estado", "intentos", "fecha_programada", "snapshot"])
+    return len(envios)
+
+
+def cancelar(turno_ids) -> int:
+    """Saca de la agenda los envíos pendientes de esos turnos (un UPDATE)."""
+    turno_ids = list(turno_ids)
+    if not turno_ids:
+        return 0
+    return EnvioProgramado.objects.filter(
+        id_turno__in=turno_ids, estado=EnvioProgramado.PENDIENTE,
+    ).update(estado=EnvioProgramado.CANCELADO)
+
+
+def peor_envio() -> float:
+    """Segundos que puede tardar un request de gateway_async con todos sus reintentos."""
+    r = settings.GATEWAY_REINTENTOS
+    return ((settings.GATEWAY_CONNECT_TIMEOUT + settings.GATEWAY_READ_TIMEOUT) * (r + 1)
+            + settings.GATEWAY_BACKOFF * (2 ** r - 1 + r))
+
+
+def lease() -> int:
+    """Lease de las filas reclamadas: holgado frente a una ráfaga en el peor caso."""
+    return max(settings.PROGRAMADOS_LEASE, int(2 * peor_envio()) + 1)
+
+
+def _vence() -> datetime:
+    # DATETIME sin fracción: el lease se compara por igualdad
+    return datetime.now().replace(microsecond=0) + timedelta(seconds=lease())
+
+
+def _propias(filas) -> Q:
+    """Filas que siguen reclamadas por esta corrida (ENVIANDO con el lease que escribió)."""
+    q = Q(pk__in=[])
+    for f in filas:
+        q |= Q(pk=f.pk, fecha_programada=f.fecha_programada)
+    return Q(estado=EnvioProgramado.ENVIANDO) & q
+
+
+def reclamar(lote: int) -> list[EnvioProgramado]:
+    """Toma hasta `lote` filas vencidas; otros despachadores saltean las bloqueadas."""
+    ahora = datetime.now()
+    vence = _vence()
+    with transaction.atomic():
+        filas = list(
+            EnvioProgramado.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                estado__in=(EnvioProgramado.PENDIENTE, EnvioProgramado.ENVIANDO),
+                fecha_programada__lte=ahora,
+            )
+            .order_by("fecha_programada", "id")[:lote]
+        )
+        if filas:
+            EnvioProgramado.objects.filter(pk__in=[f.pk for f in filas]).update(
+                estado=EnvioProgramado.ENVIANDO, fecha_programada=vence)
+            for f in filas:
+                f.estado, f.fecha_programada = EnvioProgramado.ENVIANDO, vence
+    return filas
+
+
+def _renovar(filas) -> list[EnvioProgramado]:
+    """Extiende el lease de las filas que siguen siendo de esta corrida y las devuelve."""
+    vence = _vence()
+    with transaction.atomic():
+        propias = set(
+            EnvioProgramado.objects.select_for_update()
+            .filter(_propias(filas)).values_list("pk", flat=True)
+        )
+        EnvioProgramado.objects.filter(pk__in=propias).update(fecha_programada=vence)
+    for f in filas:
+        if f.pk in propias:
+            f.fecha_programada = vence
+    return [f for f in filas if f.pk in propias]
+
+
+def _devolver(filas, segundos: float, intento: bool = False) -> None:
+    if not filas:
+        return
+    EnvioProgramado.objects.filter(_propias(filas)).update(
+        estado=EnvioProgramado.PENDIENTE,
+        fecha_programada=datetime.now() + timedelta(seconds=segundos),
+        intentos=F("intentos") + (1 if intento else 0),
+    )
+
+
+def _cerrar(fila: EnvioProgramado, estado: int) -> None:
+    EnvioProgramado.objects.filter(_propias([fila])).update(
+        estado=estado, fecha_envio=datetime.now(), intentos=F("intentos") + 1)
+
+
+def valores(datos: dict, ef_row) -> dict:
+    """Valores de la plantilla de recordatorio a partir de un snapshot hidratado."""
+    nombre_efector = datos["efector"]
+    calle = altura = letra = coordx = coordy = tel_efe = calle_nom = None
+    # dirección y contacto del efector desde la copia local
+    if ef_row:
+        (_, nombre_efector, calle, altura, letra,
+         coordx, coordy, tel_efe, calle_nom) = ef_row
+    return {
+        "nompac": datos["nom_pac"],
+        "apepac": datos["ape_pac"],
+        "fecha": parse_date(datos["fecha"]).strftime("%d-%m-%Y"),
+        "horaturno": parse_time(datos["hora"]).strftime("%H:%M"),
+        "nomprof": datos["nom_prof"],
+        "apeprof": datos["ape_prof"],
+        "especialidad": datos["especialidad"],
+        "efector": nombre_efector,
+        "nombre_servicio": datos["servicio"],
+        "calle": calle,
+        "altura": altura,
+        "letra": letra,
+        "coordx": coordx,
+        "coordy": coordy,
+        "tel_efe": tel_efe,
+        "calle_nom": calle_nom,
+    }
+
+
+def despachar(lote: int) -> dict:
+    filas = reclamar(lote)
+    cuenta = {"reclamados": len(filas), "enviados": 0, "omitidos": 0, "devueltos": 0}
+    if not filas:
+        return cuenta
+
+    turnos = Turno.objects.in_bulk({f.id_turno_id for f in filas})
+    detalles = snapshots.hidratar((f.snapshot, f.id_turno_id) for f in filas)
+    faltan = [t for pk, t in turnos.items() if pk not in detalles]
+    if faltan:
+        print(f"[WARN] {len(faltan)} recordatorios sin snapshot, se releen de Informix")
+        detalles.update(snapshots.recargar(faltan))
+    intentados = set(
+        Mensaje.objects
+        .filter(id_turno__in=turnos, id_plantilla__id_tipo__id=RECORDATORIO)
+        .values_list("id_turno", flat=True)
+    )
+    rechazos = telefonos.rechazados({t.id_paciente for t in turnos.values()})
+    efectores = direcciones({int(d["id_efector"]) for d in detalles.values() if d["id_efector"] is not None})
+
+    listos = []  # (fila, turno, plantilla, numero, texto)
+    for f in filas:
+        turno = turnos.get(f.id_turno_id)
+        # el turno cambió de estado, ya tiene recordatorio o ya se intentó: no se envía
+        if (turno is None or turno.id_estado_id != 1 or turno.msj_recordatorio == 1
+                or turno.pk in intentados):
+            _cerrar(f, EnvioProgramado.CANCELADO)
+            cuenta["omitidos"] += 1
+            continue
+
+        send, plantilla = check_turno(turno.id_efe_ser_esp_id, RECORDATORIO)
+        if not send or not plantilla:
+            _cerrar(f, EnvioProgramado.CANCELADO)
+            cuenta["omitidos"] += 1
+            continue
+
+        detalle = detalles.get(turno.pk)
+        if detalle is None:
+            print(f"[WARN] Sin detalles en Informix para turno {turno.id_sisr}, no se envía recordatorio")
+            _cerrar(f, EnvioProgramado.FALLIDO)
+            cuenta["omitidos"] += 1
+            continue
+
+        numero = telefonos.telefono_paciente(turno.id_paciente, detalle["carac_tel"], detalle["tel"], rechazos)
+        if not numero:
+            print(f"[DEBUG] No hay teléfono válido para turno {turno.id_sisr}")
+            create_Mensaje(None, turno, None, plantilla, -3, None, None)
+            _cerrar(f, EnvioProgramado.FALLIDO)
+            cuenta["omitidos"] += 1
+            continue
+
+        ef_row = efectores.get(int(detalle["id_efector"])) if detalle["id_efector"] is not None else None
+        listos.append((f, turno, plantilla, numero, valores(detalle, ef_row)))
+
+    # textos en bloque, una pasada por plantilla
+    por_plantilla = {}
+    for i, l in enumerate(listos):
+        por_plantilla.setdefault(l[2].pk, []).append(i)
+    for indices in por_plantilla.values():
+        textos = plantillas.render_lote(listos[indices[0]][2], [listos[i][4] for i in indices])
+        for i, texto in zip(indices, textos):
+            listos[i] = listos[i][:4] + (texto,)
+
+    # con un Flow abierto en ese número el recordatorio se posterga
+    abiertos = set(
+        Flow.objects
+        .filter(numero__in={l[3] for l in listos}, id_estado_id=0)
+        .values_list("numero", flat=True)
+    )
+    pendientes = []
+    en_espera = {}  # numero -> ids de envio_programado
+    for l in listos:
+        f = l[0]
+        if l[3] not in abiertos:
+            pendientes.append(l)
+        elif f.intentos + 1 < settings.PROGRAMADOS_FLOW_REINTENTOS:
+            print(f"[INFO] Flow abierto para turno {l[1].id_sisr}, recordatorio en espera del cierre")
+            # la espera larga es el respaldo; el cierre del Flow lo libera antes
+            _devolver([f], settings.PROGRAMADOS_FLOW_ESPERA, intento=True)
+            en_espera.setdefault(l[3], []).append(f.pk)
+            cuenta["devueltos"] += 1
+        else:
+            print(f"[WARN] Flow abierto tras {f.intentos + 1} intentos para turno {l[1].id_sisr}, no se enviará recordatorio")
+            _cerrar(f, EnvioProgramado.FALLIDO)
+            cuenta["omitidos"] += 1
+
+    for numero, ids in en_espera.items():
+        espera_flow.esperar(numero, programados=ids)
+
+    # cupo del limitador sin dormir: sale solo lo que tiene token, en una
+    # sola ráfaga (a lo sumo GATEWAY_CONCURRENCIA); el resto vuelve a la agenda
+    salen, resto, espera = [], [], 0.0
+    for l in pendientes:
+        if resto or len(salen) >= settings.GATEWAY_CONCURRENCIA:
+            resto.append(l[0])
+        elif (espera := -limitador.reservar(espera_max=0)) > 0:
+            resto.append(l[0])
+        else:
+            salen.append(l)
+    if resto:
+        _devolver(resto, espera)
+        cuenta["devueltos"] += len(resto)
+
+    # justo antes de la ráfaga: fuera las filas que otra corrida tomó (lease vencido)
+    if salen:
+        propias = {f.pk for f in _renovar([l[0] for l in salen])}
+        if len(propias) < len(salen):
+            print(f"[WARN] {len(salen) - len(propias)} recordatorios tomados por otra corrida, se saltean")
+            cuenta["omitidos"] += len(salen) - len(propias)
+            salen = [l for l in salen if l[0].pk in propias]
+
+    resultados = enviar_lote((numero, texto) for _, _, _, numero, texto in salen)
+    for (f, turno, plantilla, numero, _), (estado, ack, data) in zip(salen, resultados):
+        # solo lo que seguro no salió (503: gateway caído o circuito abierto) vuelve con
+        # backoff; un 504 o error de lectura pudo haber salido y se registra como falla
+        if estado == 503 and f.intentos + 1 < settings.REENVIO_MAX_INTENTOS:
+            _devolver([f], min(settings.CIRCUITO_ABIERTO_SEG * 2 ** f.intentos, 3600), intento=True)
+            cuenta["devueltos"] += 1
+            continue
+
+        telefonos.registrar_resultado(turno.id_paciente, numero, ack)
+        with transaction.atomic():
+            create_Mensaje(data.get("id"), turno, numero, plantilla, ack, data.get("time"), data.get("session"))
+            if ack >= 0:
+                Turno.objects.filter(pk=turno.pk).update(msj_recordatorio=1)
+            _cerrar(f, EnvioProgramado.HECHO if ack >= 0 else EnvioProgramado.FALLIDO)
+        cuenta["enviados"] += 1
+
+    return cuenta
@@ -1,11 +1,64 @@
+from django.conf import settings
 
-def query_detalles_turno(size: int) -> str: 
+# Listas IN con texto estable: cada consulta usa uno de estos tamaños y
+# completa con CENTINELA (ningún id es negativo), así Informix ve pocos
+# textos distintos y reutiliza planes. Más de INFORMIX_IN_TEMP ids van por
+# una tabla temporal en lugar de listas.
+TAMANIOS_IN = (1, 10, 50, 200, 500)
+CENTINELA = -1
+TABLA_IN = "tmp_ids_in"
 
+
+def tamanio_in(n: int) -> int:
+    """Menor tamaño de TAMANIOS_IN que alcanza para n ids."""
+    for t in TAMANIOS_IN:
+        if n <= t:
+            return t
+    return TAMANIOS_IN[-1]
+
+
+def lotes_in(ids) -> list[list]:
+    """Parte ids en bloques de a lo sumo TAMANIOS_IN[-1], completados con CENTINELA."""
+    ids = list(ids)
+    maximo = TAMANIOS_IN[-1]
+    lotes = []
+    for inicio in range(0, len(ids), maximo):
+        bloque = ids[inicio:inicio + maximo]
+        lotes.append(bloque + [CENTINELA] * (tamanio_in(len(bloque)) - len(bloque)))
+    return lotes
+
+
+def lista_in(columna: str, size: int | None) -> str:
+    """WHERE para `size` placeholders; size=None filtra contra la tabla temporal."""
+    if size is None:
+        return f"WHERE {columna} IN (SELECT id FROM {TABLA_IN})"
     if size == 1:
-        where_clause = "WHERE tur.idturno = ?"
-    else:
-        placeholders = ",".join(["?"] * size)
-        where_clause = f"WHERE tur.idturno IN ({placeholders})"
+        return f"WHERE {columna} = ?"
+    placeholders = ",".join(["?"] * size)
+    return f"WHERE {columna} IN ({placeholders})"
+
+
+def usar_tabla_in(n: int) -> bool:
+    return n > settings.INFORMIX_IN_TEMP
+
+
+def cargar_tabla_in(cur, ids) -> None:
+    """Crea (o vacía) la tabla temporal de la sesión y carga los ids."""
+    try:
+        cur.execute(f"DROP TABLE {TABLA_IN}")
+    except Exception:
+        pass
+    cur.execute(f"CREATE TEMP TABLE {TABLA_IN} (id INTEGER) WITH NO LOG")
+    cur.executemany(f"INSERT INTO {TABLA_IN} (id) VALUES (?)", [[i] for i in ids])
+
+
+def borrar_tabla_in(cur) -> None:
+    cur.execute(f"DROP TABLE {TABLA_IN}")
+
+
+def query_detalles_turno(size: int | None) -> str: 
+
+    where_clause = lista_in("tur.idturno", size)
 
     return f"""
     SELECT
@@ -49,20 +102,26 @@ def query_detalles_turno(size: int) -> str:
     """
 
 
-def query_persona() -> str:
-    return """
+def query_persona(size: int | None = 1) -> str:
+    where_clause = lista_in("per.id_persona", size)
+
+    return f"""
     SELECT 
+        per.id_persona,
         TRIM(per.apellido) AS apePac,
         TRIM(per.nombre_per) AS nomPac,
         TRIM(per.carac_telef) AS caracTelPacV_personas,
         CAST(per.nro_telef AS VARCHAR(13)) AS telPacV_personas
     FROM v_personas per
-    WHERE per.id_persona = ?
+    {where_clause}
     """
 
-def query_efector() -> str:
-    return """
+def query_efector(size: int | None = 1) -> str:
+    where_clause = lista_in("efe.idefector", size)
+
+    return f"""
     SELECT 
+        efe.idefector,
         efe.nombre AS efector,
         TRIM(efe.nomcalle) AS calleEfe,
         efe.numero AS alturaCalleEfe,
@@ -73,19 +132,28 @@ def query_efector() -> str:
         TRIM(calle.nom_calle) AS calleEfeV_calles
     FROM efectores efe
     LEFT JOIN v_calles calle ON calle.cod_calle = efe.cod_calle
-    WHERE efe.idefector = ?
+    {where_clause}
     """
 
 
-def query_turnos_historico() -> str:
-    return """
-    SELECT idturno, idpaciente, idestadoturno, fecha_hora_mdf
+def query_turnos_historico(size: int) -> str:
+    # paginado por keyset: la página siguiente arranca después de la última fecha_hora_mdf
+    return f"""
+    SELECT FIRST {int(size)} idturno, idpaciente, idestadoturno, fecha_hora_mdf
     FROM turnoshistorico
     WHERE fecha_hora_mdf > ?
     ORDER BY fecha_hora_mdf
     """
 
 
+def query_turnos_historico_instante() -> str:
+    return """
+    SELECT idturno, idpaciente, idestadoturno, fecha_hora_mdf
+    FROM turnoshistorico
+    WHERE fecha_hora_mdf = ?
+    """
+
+
 def query_turno_historico_paciente() -> str:
     return """
         (SELECT 
@@ -147,12 +215,8 @@ def query_turno_historico_paciente() -> str:
 
 
 
-def query_turnos(n: int) -> str:
-    if n == 1:
-        where_clause = "WHERE t.idturno = ?"
-    else:
-        placeholders = ",".join(["?"] * n)
-        where_clause = f"WHERE t.idturno IN ({placeholders})"
+def query_turnos(n: int | None) -> str:
+    where_clause = lista_in("t.idturno", n)
     return f"""
         SELECT t.idturno, t.idpaciente AS paciente_id, TRIM(per.nombre_per) AS paciente_nombre, TRIM(per.apellido) AS paciente_apellido,
         per.nro_doc, TRIM(p.nombre) AS profesional_nombre, TRIM(p.apellido) AS profesional_apellido
@@ -164,12 +228,8 @@ def query_turnos(n: int) -> str:
     """ 
 
 
-def query_eliminado(n: int) -> str:
-    if n == 1:
-        where_clause = "WHERE te.idturno = ?"
-    else:
-        placeholders = ",".join(["?"] * n)
-        where_clause = f"WHERE te.idturno IN ({placeholders})"
+def query_eliminado(n: int | None) -> str:
+    where_clause = lista_in("te.idturno", n)
     return f"""   
         SELECT te.idturno,te.idpaciente AS paciente_id, TRIM(per.nombre_per) AS paciente_nombre, TRIM(per.apellido) AS paciente_apellido,
         per.nro_doc, TRIM(p.nombre) AS nombre_profesional, TRIM(p.apellido) AS apellido_profesional
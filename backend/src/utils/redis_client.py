@@ -0,0 +1,18 @@
+import os
+import redis
+from django.conf import settings
+
+_cliente = None
+_pid = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    Cliente Redis compartido dentro del proceso. Se recrea después de un fork
+    (hijos prefork de Celery, workers de gunicorn) para no heredar sockets.
+    """
+    global _cliente, _pid
+    if _cliente is None or _pid != os.getpid():
+        _cliente = redis.Redis.from_url(settings.REDIS_URL)
+        _pid = os.getpid()
+    return _cliente
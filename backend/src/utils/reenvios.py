@@ -0,0 +1,51 @@
+"""
+Cola de reenvío (lista en Redis) para avisos que no salieron porque el
+gateway no estaba disponible (circuito abierto o 503). Cada entrada es una
+tarea de Celery con sus argumentos; drenar() las vuelve a encolar cuando el
+circuito está cerrado, y con el circuito medio abierto suelta una sola que
+hace de prueba (sin ella, en horas sin tráfico nada lo cerraría). La tarea
+recibe reenvios=n para cortar a los REENVIO_MAX_INTENTOS.
+"""
+import json
+from celery import current_app
+from django.conf import settings
+from .gateway import circuito
+from .redis_client import get_redis
+
+CLAVE = "notificaciones:reenvio"
+
+
+def encolar(tarea: str, args, reenvios: int = 0) -> bool:
+    """
+    Agrega la tarea a la cola. False si ya agotó los reintentos y el
+    llamador debe registrar la falla como antes.
+    """
+    if reenvios >= settings.REENVIO_MAX_INTENTOS:
+        return False
+    item = {"tarea": tarea, "args": list(args), "reenvios": reenvios + 1}
+    get_redis().rpush(CLAVE, json.dumps(item, default=str))
+    return True
+
+
+def drenar(lote: int) -> int:
+    """
+    Reencola hasta `lote` tareas si el circuito está cerrado, o una sola de
+    prueba si está medio abierto. Devuelve cuántas.
+    """
+    if not circuito.cerrado():
+        if not circuito.tomar_sonda():
+            return 0
+        lote = 1
+    r = get_redis()
+    pipe = r.pipeline()
+    pipe.lrange(CLAVE, 0, lote - 1)
+    pipe.ltrim(CLAVE, lote, -1)
+    items, _ = pipe.execute()
+    for raw in items:
+        item = json.loads(raw)
+        current_app.send_task(item["tarea"], args=item["args"], kwargs={"reenvios": item["reenvios"]})
+    return len(items)
+
+
+def pendientes() -> int:
+    return get_redis().llen(CLAVE)
@@ -0,0 +1,107 @@
+"""
+Modo simulación (dry-run) del circuito de avisos.
+
+- NOTIF_SIMULACION=True (setting): todo el despliegue envía al registro de
+  simulación en lugar de API_WHATSAPP; el resto del circuito (Informix,
+  render, bandeja, programación) funciona igual. Pensado para un entorno de
+  réplica donde se reproducen días de producción.
+- corrida(): lo usan verificar_turnos / programar_recordatorios con
+  simulacion=True. Además de desviar los envíos, las escrituras de cada
+  página (o de la agenda) van en atomica(), que dentro de una corrida se
+  descarta al salir: no quedan cambios y los locks de InnoDB duran una
+  página, no toda la corrida (que así no frena al poll real). Cada página
+  simulada no ve lo que escribieron las anteriores.
+
+Los envíos simulados quedan en una lista de Redis (SIMULACION_MAX_REGISTROS
+últimos) y Resumen junta tiempos y volúmenes por etapa de cada corrida.
+"""
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from django.conf import settings
+from django.db import transaction
+from rest_framework.response import Response
+from redis.exceptions import RedisError
+from .redis_client import get_redis
+
+CLAVE = "notificaciones:simulacion:envios"
+
+_corrida = ContextVar("simulacion_corrida", default=False)
+
+
+def activa() -> bool:
+    return settings.NOTIF_SIMULACION or _corrida.get()
+
+
+def en_corrida() -> bool:
+    return _corrida.get()
+
+
+@contextmanager
+def corrida():
+    """Envíos al registro; las escrituras en atomica() se descartan."""
+    token = _corrida.set(True)
+    try:
+        yield
+    finally:
+        _corrida.reset(token)
+
+
+@contextmanager
+def atomica():
+    """transaction.atomic() que dentro de una corrida se descarta al salir."""
+    with transaction.atomic():
+        yield
+        if en_corrida():
+            transaction.set_rollback(True)
+
+
+def registrar_envio(numero: str, texto: str) -> Response:
+    """Guarda el envío en el registro y responde como el gateway (ack 1)."""
+    id_mensaje = f"sim-{uuid.uuid4().hex[:20]}"
+    item = {"id": id_mensaje, "numero": numero, "texto": texto, "fecha": datetime.now().isoformat()}
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.lpush(CLAVE, json.dumps(item))
+        pipe.ltrim(CLAVE, 0, settings.SIMULACION_MAX_REGISTROS - 1)
+        pipe.execute()
+    except RedisError as ex:
+        print(f"[WARN] no se pudo registrar envío simulado: {ex}")
+    return Response({"ack": 1, "id": id_mensaje, "session": settings.WHATSAPP_SESION}, status=200)
+
+
+def envios(n: int = 100) -> list[dict]:
+    """Últimos n envíos simulados (el más reciente primero)."""
+    return [json.loads(x) for x in get_redis().lrange(CLAVE, 0, n - 1)]
+
+
+class Resumen:
+    """Tiempo acumulado y volumen por etapa de una corrida."""
+
+    def __init__(self, tarea: str):
+        self.tarea = tarea
+        self.inicio = time.monotonic()
+        self.tiempos = {}
+        self.volumen = {}
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + time.monotonic() - t0
+
+    def sumar(self, nombre: str, n: int = 1) -> None:
+        self.volumen[nombre] = self.volumen.get(nombre, 0) + n
+
+    def emitir(self) -> None:
+        total = time.monotonic() - self.inicio
+        etapas = ", ".join(f"{k}={v:.2f}s" for k, v in self.tiempos.items())
+        volumen = ", ".join(f"{k}={v}" for k, v in self.volumen.items())
+        modo = " (simulación)" if activa() else ""
+        print(f"[INFO] Resumen {self.tarea}{modo}: total={total:.2f}s; {etapas}; {volumen}")
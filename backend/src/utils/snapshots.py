@@ -0,0 +1,91 @@
+"""
+Snapshots de detalles de turnos para los recordatorios.
+
+programar_recordatorios guarda una vez por corrida, en un hash de Redis, los
+datos de paciente, profesional y turno que necesita el texto (la dirección
+del efector sale de la copia local, src.utils.efectores). Los envíos
+programados y send_reminder_task llevan solo el id local del Turno y la
+clave del snapshot, y se hidratan en bloque al enviar. Si el snapshot
+venció o Redis no lo tiene, se vuelve a leer de Informix.
+"""
+import json
+import uuid
+from django.db import connections
+from redis.exceptions import RedisError
+from .redis_client import get_redis
+from .querys_informix import query_detalles_turno
+from .utils import fetch_por_lotes
+
+PREFIJO = "notificaciones:snapshot:"
+
+# orden de los valores guardados por turno
+CAMPOS = ("id_efector", "ape_pac", "nom_pac", "fecha", "hora", "ape_prof", "nom_prof",
+          "servicio", "especialidad", "efector", "carac_tel", "tel")
+
+
+def de_detalle(row) -> list:
+    """Valores de CAMPOS a partir de una fila de query_detalles_turno."""
+    return [row[1], row[7], row[8], row[9], row[10], row[11], row[12],
+            row[13], row[14], row[15], row[23], row[24]]
+
+
+def clave_nueva() -> str:
+    return PREFIJO + uuid.uuid4().hex[:16]
+
+
+def guardar(clave: str, filas: dict, ttl: int) -> bool:
+    """filas: {id local del Turno: fila de query_detalles_turno}."""
+    if not filas:
+        return True
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.hset(clave, mapping={
+            str(id): json.dumps(de_detalle(row), default=str, separators=(",", ":"))
+            for id, row in filas.items()
+        })
+        pipe.expire(clave, ttl)
+        pipe.execute()
+        return True
+    except RedisError as ex:
+        print(f"[WARN] no se pudo guardar el snapshot {clave}: {ex}")
+        return False
+
+
+def hidratar(pares) -> dict:
+    """pares: (clave, id local). Devuelve {id: dict de CAMPOS} con lo que haya en Redis."""
+    por_clave = {}
+    for clave, id in pares:
+        if clave:
+            por_clave.setdefault(clave, []).append(int(id))
+    if not por_clave:
+        return {}
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        for clave, ids in por_clave.items():
+            pipe.hmget(clave, [str(i) for i in ids])
+        respuestas = pipe.execute()
+    except RedisError as ex:
+        print(f"[WARN] no se pudo leer snapshots: {ex}")
+        return {}
+
+    datos = {}
+    for ids, valores in zip(por_clave.values(), respuestas):
+        for id, v in zip(ids, valores):
+            if v is not None:
+                datos[id] = dict(zip(CAMPOS, json.loads(v)))
+    return datos
+
+
+def recargar(turnos) -> dict:
+    """Relee de Informix los turnos sin snapshot. turnos: Turno locales."""
+    por_sisr = {t.id_sisr: t.pk for t in turnos}
+    if not por_sisr:
+        return {}
+    with connections["informix"].cursor() as cur:
+        filas = fetch_por_lotes(cur, query_detalles_turno, list(por_sisr))
+    return {
+        por_sisr[id_sisr]: dict(zip(CAMPOS, de_detalle(row)))
+        for id_sisr, row in filas.items() if id_sisr in por_sisr
+    }
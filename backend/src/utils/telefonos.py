@@ -0,0 +1,81 @@
+"""
+Normalización y validación de teléfonos de pacientes (Argentina) para WhatsApp.
+
+normalizar() arma el número internacional de celular 549 + característica +
+número a partir de los campos de Informix: deja solo dígitos, quita el 0 de
+la característica y el 15 del número, y exige 10 dígitos entre ambos. Lo que
+no cumple se descarta antes de llamar al gateway.
+
+Los números que el gateway rechaza (404/422: no existe o no tiene WhatsApp,
+p. ej. un fijo) se recuerdan por idpaciente en Redis durante TELEFONO_TTL
+días, mientras el número de Informix no cambie.
+"""
+import re
+from functools import lru_cache
+from django.conf import settings
+from redis.exceptions import RedisError
+from .redis_client import get_redis
+
+PREFIJO = "notificaciones:telefono:rechazado"
+ACKS_RECHAZO = (-3, -2)  # 404, 422
+
+_NO_DIGITOS = re.compile(r"\D")
+
+
+def limpiar(valor) -> str:
+    return _NO_DIGITOS.sub("", str(valor)) if valor is not None else ""
+
+
+@lru_cache(maxsize=50000)
+def normalizar(carac, tel) -> str | None:
+    """Número 549XXXXXXXXXX o None si no es un celular válido."""
+    carac, tel = limpiar(carac), limpiar(tel)
+    if not carac and tel.startswith("549") and len(tel) == 13:
+        return tel
+    carac = carac.lstrip("0")
+    if tel.startswith("15") and len(carac) + len(tel) == 12:
+        tel = tel[2:]
+    if not (2 <= len(carac) <= 4) or len(carac) + len(tel) != 10:
+        return None
+    return "549" + carac + tel
+
+
+def _key(idpaciente) -> str:
+    return f"{PREFIJO}:{idpaciente}"
+
+
+def rechazados(idpacientes) -> dict:
+    """{idpaciente: número rechazado} para los que tienen uno registrado (un MGET)."""
+    ids = [i for i in set(idpacientes) if i is not None]
+    if not ids:
+        return {}
+    try:
+        valores = get_redis().mget([_key(i) for i in ids])
+    except RedisError:
+        return {}
+    return {i: v.decode() for i, v in zip(ids, valores) if v}
+
+
+def telefono_paciente(idpaciente, carac, tel, rechazos: dict | None = None) -> str | None:
+    """
+    Número enviable del paciente o None. rechazos es el resultado de
+    rechazados() cuando ya se consultó en bloque.
+    """
+    numero = normalizar(carac, tel)
+    if numero is None:
+        return None
+    if rechazos is None:
+        rechazos = rechazados([idpaciente])
+    if rechazos.get(idpaciente) == numero:
+        return None
+    return numero
+
+
+def registrar_resultado(idpaciente, numero: str, ack: int) -> None:
+    """Recuerda el número si el gateway lo rechazó."""
+    if idpaciente is None or ack not in ACKS_RECHAZO:
+        return
+    try:
+        get_redis().set(_key(idpaciente), numero, ex=settings.TELEFONO_TTL * 86400)
+    except RedisError:
+        pass
@@ -1,78 +1,30 @@
 import requests
-import emoji
 from decouple import config
-from src.models import EfeSerEspPlantilla, Mensaje, Flow, TurnoFlow, Turno, Plantilla, TurnoEspera
-import re
+from src.models import (Mensaje, Flow, TurnoFlow, Turno, Plantilla, TurnoEspera, EventoProcesado, BandejaSalida,
+                        EnvioProgramado)
 import logging
 logger = logging.getLogger(__name__)
 from rest_framework.response import Response
 from rest_framework import status
 from django.utils.timezone import now
-from django.db import connections, DatabaseError
+from django.db import connections, transaction, DatabaseError
+from django.db.models import Func, DateField
 from datetime import timedelta, datetime, date, time
-from .querys_informix import query_profesional_from_id,query_profesional_from_nombre, query_paciente
-
-
-
-def update_msg_state(mensaje: Mensaje) -> Mensaje:
-    """
-    Consulta la API externa por el estado del mensaje y actualiza Mensaje(pk=mensaje_id).
-    Devuelve el Mensaje actualizado o el original si hay error.
-    """
-    api_url = config("API_ESTADO_WHATSAPP")
-    params = {
-        "session": mensaje.id_sesion_id,
-        "numero": mensaje.numero,
-        "id": mensaje.id_mensaje
-    }
-
-    session = requests.Session()
-    session.trust_env = False 
-
-    try:
-        resp = session.get(
-            api_url,
-            params=params,
-            headers={
-                "Accept": "application/json"
-            },
-            timeout=5
-        )
-
-        content_type = resp.headers.get("Content-Type", "")
-
-        if "application/json" not in content_type:
-            return mensaje
-
-        data = resp.json()
-
-    except requests.exceptions.RequestException:
-        return mensaje
-    except ValueError:
-        return mensaje
-
-    # Actualizar Mensaje local si existe
-    try:
-        mensaje.fecha_last_ack = now()
-        if isinstance(data, dict) and "ack" in data:
-            mensaje.id_estado_id = data["ack"]
-
-        mensaje.save(update_fields=["fecha_last_ack", "id_estado"])
-        return mensaje
-
-    except Exception:
-        return mensaje
+from .querys_informix import (query_profesional_from_id,query_profesional_from_nombre, query_paciente,
+                              lotes_in, usar_tabla_in, cargar_tabla_in, borrar_tabla_in)
+from .ledger import nuevos_registros
+from . import config_notif, gateway, simulacion
 
 
 
 def enviar_whatsapp(numero: str, mensaje: str) -> Response:
-    api_url = config('API_WHATSAPP')
+    if simulacion.activa():
+        return simulacion.registrar_envio(numero, mensaje)
 
-    session = requests.Session()
-    session.trust_env = False  # ← clave
+    api_url = config('API_WHATSAPP')
 
     try:
-        response = session.post(
+        response = gateway.post(
             api_url,
             json={
                 "numero": numero,
@@ -82,7 +34,6 @@ def enviar_whatsapp(numero: str, mensaje: str) -> Response:
                 "Content-Type": "application/json",
                 "Accept": "application/json"
             },
-            timeout=15
         )
 
         content_type = response.headers.get("Content-Type", "")
@@ -99,6 +50,12 @@ def enviar_whatsapp(numero: str, mensaje: str) -> Response:
             status=status.HTTP_502_BAD_GATEWAY
         )
 
+    except requests.exceptions.ReadTimeout as e:
+        # el gateway pudo haberlo enviado: no se trata como no disponible
+        return Response(
+            {"error": "La API WhatsApp no respondió a tiempo", "detail": str(e)},
+            status=status.HTTP_504_GATEWAY_TIMEOUT
+        )
     except requests.exceptions.RequestException as e:
         return Response(
             {"error": "No se pudo conectar con la API WhatsApp", "detail": str(e)},
@@ -108,51 +65,25 @@ def enviar_whatsapp(numero: str, mensaje: str) -> Response:
     
 def check_turno(efe_ser_esp: int, estado: int) -> (bool, Plantilla | None):
     try:
-        turno = EfeSerEspPlantilla.objects.filter(
-            id_efe_ser_esp=efe_ser_esp,
-        ).first()
-        
-        if not turno:
+        cfg = config_notif.config(efe_ser_esp)
+        if not cfg:
             return False, None
-        
-        # Mapear estado → tipo y campo de plantilla
-        mapping = {
-            1: ("confirmacion", "plantilla_conf"),
-            2: ("cancelacion", "plantilla_canc"),
-            3: ("reprogramacion", "plantilla_repr"),
-        }
-        
-        tipo, campo_plantilla = mapping.get(estado, ("recordatorio", "plantilla_reco"))
-        
+
+        # estados sin tipo propio se tratan como recordatorio
+        tipo = estado if estado in config_notif.TIPOS else 4
+
         # Chequear si el flag booleano del tipo está activo
-        if getattr(turno, tipo) == 1:  
-            plantilla = getattr(turno, campo_plantilla)
-            if plantilla:
-                plantilla.contenido = emoji.emojize(plantilla.contenido)
-            return True, plantilla
+        if cfg["banderas"][tipo]:
+            return True, cfg["plantillas"][tipo]
 
-        
         return False, None
-    
+
     except Exception as e:
         print(f"Error en check_turno: {e}")
         return False, None
 
 
 
-def format_plantilla(contenido: str, valores) -> str:
-    """
-    Reemplaza placeholders en la plantilla con valores reales
-    Ejemplo: {nompac} -> Juan
-    """
-    def replace_match(match):
-        key = match.group(1)  # Obtiene el nombre entre llaves
-        return str(valores.get(key, match.group(0)))  # Reemplaza o deja original si no existe
-    
-    # Usa expresión regular para encontrar {placeholder}
-    return re.sub(r'{(\w+)}', replace_match, contenido)
-
-
 def fetch_paciente(id_persona=None, dni=None):
     """
     Retorna lista de dicts con pacientes (posiblemente vacía).
@@ -225,6 +156,31 @@ def fetch_profesional(id_prof=None, id_efector=None, nombre=None, apellido=None)
         raise
 
 
+def fetch_por_lotes(cur, query_builder, ids) -> dict:
+    """
+    Ejecuta query_builder sobre los ids y devuelve un dict {primera columna: fila}.
+    Una consulta por bloque de lotes_in (textos de tamaño fijo) o, para
+    conjuntos muy grandes, una sola contra la tabla temporal.
+    """
+    resultado = {}
+    ids = [i for i in dict.fromkeys(ids) if i is not None]
+    if usar_tabla_in(len(ids)):
+        cargar_tabla_in(cur, ids)
+        try:
+            cur.execute(query_builder(None))
+            for row in cur.fetchall():
+                resultado[row[0]] = row
+        finally:
+            borrar_tabla_in(cur)
+        return resultado
+
+    for bloque in lotes_in(ids):
+        cur.execute(query_builder(len(bloque)), bloque)
+        for row in cur.fetchall():
+            resultado[row[0]] = row
+    return resultado
+
+
 def start_flow(numero: str, flowName: str) -> Response:
     api_url = config('API_WHATSAPP_FLOW') 
     
@@ -240,7 +196,7 @@ def start_flow(numero: str, flowName: str) -> Response:
 
     try:
         # Realizar solicitud a la API externa
-        response = requests.post(api_url, data=payload)
+        response = gateway.post(api_url, data=payload)
         
         # Devolver la respuesta directa del servidor externo
         # Incluyendo el código de estado y el contenido
@@ -264,29 +220,60 @@ def start_flow(numero: str, flowName: str) -> Response:
     
 
 
-def update_estado_Turno(id_sisr: int, id_pac: int, id_est: int) -> Turno | None: 
-    try:
-        # Obtener instancia
-        t = Turno.objects.filter(id_sisr=id_sisr, id_paciente=id_pac).first()
-        if t is None:
-            print(f"[DEBUG] No existe Turno local con id={id_sisr} => se ignora notificación (estado={id_est})")
-            return None
+def create_Mensaje(id: str | None, turno: Turno, numero: str | None,
+                plantilla: Plantilla, estado: int, fecha: datetime| None, sesion: str | None) -> None:
+    if fecha == None:
+        fecha = datetime.now()
 
-        # Asignar estado en la instancia y guardar (mínimo)
-        if t.id_estado_id != id_est:
-            t.id_estado_id = id_est
-            t.save(update_fields=["id_estado_id"])
+    Mensaje.objects.create(
+        id_mensaje=id,
+        id_turno=turno,
+        numero=numero,
+        id_plantilla=plantilla,
+        fecha_envio=fecha,
+        id_estado_id=estado,
+        id_sesion_id=sesion
+    )
 
-        print(f"[INFO] Actualizado Turno id={id_sisr} a estado={id_sisr}")
-        return t
-    
-    except Exception as ex:
-        print(f"[ERROR] al actualizar Turno id={id_sisr}: {ex}")
-        return None
 
-def create_Turno(id_sisr: int, id_pac: int, id_est: int, 
-                 id_ess: int, fecha: date, hora: time) -> Turno:
-    t = Turno.objects.create(
+
+class UnidadDeTrabajo:
+    """
+    Acumula las escrituras de un lote (altas de Turno, cambios de estado,
+    Mensaje, flags msj_* y avisos para la bandeja de salida) y las baja con
+    bulk_create/bulk_update en una sola transacción. Los turnos existentes se
+    resuelven con una única consulta id_sisr__in en cargar_turnos(). Si el
+    bloque falla, flush_por_filas() lo reintenta fila por fila y descarta solo
+    lo que no entra.
+    """
+
+    def __init__(self):
+        self.turnos = {}            # (id_sisr, id_paciente) -> Turno
+        self.nuevos = []
+        self.estados = {}           # id(turno) -> turno con id_estado modificado
+        self.flags = {}             # id(turno) -> (turno, {campos})
+        self.mensajes = []
+        self.eventos = []
+        self.avisos = []
+        self.callbacks = []
+
+    def cargar_turnos(self, claves) -> None:
+        claves = set(claves)
+        ids = {id_sisr for id_sisr, _ in claves}
+        if not ids:
+            return
+        for t in Turno.objects.filter(id_sisr__in=ids).order_by("-id"):
+            clave = (t.id_sisr, t.id_paciente)
+            if clave in claves:
+                # igual que .filter(...).first(): uno por clave (el último si hay varios)
+                self.turnos.setdefault(clave, t)
+
+    def turno(self, id_sisr: int, id_pac: int) -> Turno | None:
+        return self.turnos.get((id_sisr, id_pac))
+
+    def crear_turno(self, id_sisr: int, id_pac: int, id_est: int,
+                    id_ess: int, fecha: date, hora: time) -> Turno:
+        t = Turno(
             id_sisr=id_sisr,
             id_paciente=id_pac,
             id_estado_id=id_est,
@@ -299,24 +286,180 @@ def create_Turno(id_sisr: int, id_pac: int, id_est: int,
             fecha=fecha,
             hora=hora
         )
-    return t
-
-
-def create_Mensaje(id: str | None, turno: Turno, numero: str | None,
-                plantilla: Plantilla, estado: int, fecha: datetime| None, sesion: str | None) -> None:
-    if fecha == None:
-        fecha = datetime.now()
-
-    Mensaje.objects.create(
-        id_mensaje=id,
-        id_turno=turno,
-        numero=numero,
-        id_plantilla=plantilla,
-        fecha_envio=fecha,
-        id_estado_id=estado,
-        id_sesion_id=sesion
-    )
+        self.nuevos.append(t)
+        self.turnos[(id_sisr, id_pac)] = t
+        return t
 
+    def actualizar_estado(self, t: Turno, id_est: int) -> None:
+        if t.id_estado_id != id_est:
+            t.id_estado_id = id_est
+            if t.pk is not None:
+                self.estados[id(t)] = t
+
+    def marcar_flag(self, t: Turno, campo: str) -> None:
+        setattr(t, campo, 1)
+        self.flags.setdefault(id(t), (t, set()))[1].add(campo)
+
+    def crear_mensaje(self, id: str | None, turno: Turno, numero: str | None,
+                      plantilla: Plantilla, estado: int, fecha: datetime | None, sesion: str | None) -> None:
+        self.mensajes.append(Mensaje(
+            id_mensaje=id,
+            id_turno=turno,
+            numero=numero,
+            id_plantilla=plantilla,
+            fecha_envio=fecha or datetime.now(),
+            id_estado_id=estado,
+            id_sesion_id=sesion
+        ))
+
+    def encolar_aviso(self, turno: Turno, plantilla: Plantilla, tipo_aviso: int,
+                      numero: str, texto: str, evento: tuple | None = None) -> None:
+        """
+        Aviso a enviar por la bandeja de salida; se guarda junto con el turno.
+        evento = (fecha_hora_mdf, idestadoturno) del turnoshistorico que lo
+        origina; sin evento (avisos viejos) vale uno por turno y tipo.
+        """
+        ahora = datetime.now()
+        fecha_hora_mdf, id_estado_turno = evento or ("", tipo_aviso)
+        self.avisos.append(BandejaSalida(
+            id_turno=turno,
+            id_plantilla=plantilla,
+            tipo_aviso=tipo_aviso,
+            fecha_hora_mdf=str(fecha_hora_mdf),
+            id_estado_turno=int(id_estado_turno),
+            numero=numero,
+            texto=texto,
+            estado=BandejaSalida.PENDIENTE,
+            intentos=0,
+            fecha_alta=ahora,
+            fecha_proximo=ahora,
+        ))
+
+    def registrar_eventos(self, claves) -> None:
+        """Claves de turnoshistorico que quedan marcadas como procesadas junto con el lote."""
+        self.eventos.extend(claves)
+
+    def al_confirmar(self, fn) -> None:
+        """Registra fn para después del commit (p. ej. encolar un envío con el pk ya asignado)."""
+        self.callbacks.append(fn)
+
+    def _asignar_pks(self) -> None:
+        # MySQL no devuelve los ids de bulk_create: se recuperan con una consulta
+        pendientes = {(t.id_sisr, t.id_paciente): t for t in self.nuevos if t.pk is None}
+        if not pendientes:
+            return
+        filas = (
+            Turno.objects
+            .filter(id_sisr__in={k[0] for k in pendientes})
+            .order_by("id")
+            .values_list("id", "id_sisr", "id_paciente")
+        )
+        for pk, id_sisr, id_pac in filas:
+            t = pendientes.get((id_sisr, id_pac))
+            if t is not None:
+                t.pk = pk
+
+    def flush(self) -> None:
+        with transaction.atomic():
+            if self.nuevos:
+                Turno.objects.bulk_create(self.nuevos)
+                self._asignar_pks()
+
+            if self.estados:
+                Turno.objects.bulk_update(list(self.estados.values()), ["id_estado"])
+                # los turnos que dejan de estar asignados salen de la agenda de recordatorios
+                EnvioProgramado.objects.filter(
+                    id_turno__in=[t.pk for t in self.estados.values() if t.id_estado_id != 1],
+                    estado=EnvioProgramado.PENDIENTE,
+                ).update(estado=EnvioProgramado.CANCELADO)
+
+            por_campos = {}
+            for t, campos in self.flags.values():
+                por_campos.setdefault(tuple(sorted(campos)), []).append(t)
+            for campos, turnos in por_campos.items():
+                Turno.objects.bulk_update(turnos, list(campos))
+
+            if self.mensajes:
+                # bulk_create toma el pk de los turnos recién asignados en _asignar_pks
+                Mensaje.objects.bulk_create(self.mensajes)
+
+            if self.avisos:
+                # la clave del evento de origen descarta avisos ya encolados
+                BandejaSalida.objects.bulk_create(self.avisos, ignore_conflicts=True)
+
+            if self.eventos:
+                EventoProcesado.objects.bulk_create(nuevos_registros(self.eventos), ignore_conflicts=True)
+
+            for fn in self.callbacks:
+                transaction.on_commit(fn)
+
+        self._vaciar()
+
+    def flush_por_filas(self) -> int:
+        """
+        Respaldo de flush() cuando el bloque falla (p. ej. una FK rota): cada
+        escritura va con su propio savepoint y las que fallan se descartan con
+        su Mensaje y aviso, así una fila no frena el lote. Devuelve cuántas
+        escrituras se descartaron.
+        """
+        descartadas = 0
+
+        def guardar(obj, descripcion, **kwargs) -> bool:
+            nonlocal descartadas
+            try:
+                with transaction.atomic():
+                    obj.save(**kwargs)
+                return True
+            except DatabaseError as ex:
+                print(f"[ERROR] {descripcion} descartado: {ex}")
+                descartadas += 1
+                return False
+
+        with transaction.atomic():
+            # lo que haya dejado el bloque fallido quedó deshecho
+            for obj in self.nuevos + self.mensajes + self.avisos:
+                obj.pk = None
+
+            for t in self.nuevos:
+                if not guardar(t, f"Turno id_sisr={t.id_sisr}", force_insert=True):
+                    t.pk = None
+
+            for t in self.estados.values():
+                if guardar(t, f"estado del Turno id_sisr={t.id_sisr}", update_fields=["id_estado"]) \
+                        and t.id_estado_id != 1:
+                    EnvioProgramado.objects.filter(
+                        id_turno=t.pk, estado=EnvioProgramado.PENDIENTE,
+                    ).update(estado=EnvioProgramado.CANCELADO)
+
+            for t, campos in self.flags.values():
+                if t.pk is not None:
+                    guardar(t, f"flags del Turno id_sisr={t.id_sisr}", update_fields=list(campos))
+
+            for m in self.mensajes:
+                if m.id_turno.pk is not None:
+                    guardar(m, f"Mensaje del turno id_sisr={m.id_turno.id_sisr}", force_insert=True)
+
+            for a in self.avisos:
+                if a.id_turno.pk is None:
+                    continue
+                # la clave del evento de origen descarta avisos ya encolados
+                if not BandejaSalida.objects.filter(
+                        id_turno=a.id_turno.pk, fecha_hora_mdf=a.fecha_hora_mdf,
+                        id_estado_turno=a.id_estado_turno).exists():
+                    guardar(a, f"aviso del turno id_sisr={a.id_turno.id_sisr}", force_insert=True)
+
+            if self.eventos:
+                EventoProcesado.objects.bulk_create(nuevos_registros(self.eventos), ignore_conflicts=True)
+
+            for fn in self.callbacks:
+                transaction.on_commit(fn)
+
+        self._vaciar()
+        return descartadas
+
+    def _vaciar(self) -> None:
+        self.nuevos, self.estados, self.flags = [], {}, {}
+        self.mensajes, self.eventos, self.avisos, self.callbacks = [], [], [], []
 
 
 def sacar_Turno_Espera(id_pac: int, id_efe_ser_esp: int) -> bool:
@@ -330,7 +473,15 @@ def sacar_Turno_Espera(id_pac: int, id_efe_ser_esp: int) -> bool:
 
 
 
-    
+# estado de aviso -> flag del Turno que registra el envío
+CAMPO_MSJ = {
+    1: "msj_confirmado",
+    2: "msj_cancelado",
+    3: "msj_reprogramado",
+    4: "msj_recordatorio",
+}
+
+
 def map_estdo(est: int) -> int:
     if est == 3:
         estado = 1
@@ -343,6 +494,53 @@ def map_estdo(est: int) -> int:
     return estado
 
 
+def coalescer_eventos(eventos) -> list[dict]:
+    """
+    Reduce los eventos (idturno, idpaciente, estado, fecha_hora_mdf, idestadoturno)
+    de una ventana a una transición por (idturno, idpaciente), en orden de
+    primera aparición. fecha_hora_mdf e id_estado_turno de la transición son los
+    del último evento (la clave del aviso en la bandeja de salida).
+
+    Cada transición indica si hay que crear el Turno local, el estado final a
+    persistir y qué aviso corresponde (estado de plantilla o None):
+      - termina en finalizado (4): sin aviso.
+      - asignado en la ventana y termina suspendido: sin aviso (el paciente
+        nunca supo del turno).
+      - asignado en la ventana y termina asignado/reprogramado: una sola
+        confirmación con los datos vigentes.
+      - sin asignación en la ventana: aviso del estado final (una sola
+        cancelación o reprogramación aunque haya varias).
+    """
+    grupos = {}
+    for idturno, idpaciente, estado, fecha_hora_mdf, idestadoturno in eventos:
+        grupos.setdefault((idturno, idpaciente), []).append((estado, fecha_hora_mdf, idestadoturno))
+
+    transiciones = []
+    for (idturno, idpaciente), cambios in grupos.items():
+        estados = [estado for estado, _, _ in cambios]
+        final = estados[-1]
+        crear = 1 in estados
+
+        if final == 4:
+            notificar = None
+        elif crear:
+            notificar = None if final == 2 else 1
+        else:
+            notificar = final
+
+        transiciones.append({
+            "idturno": idturno,
+            "idpaciente": idpaciente,
+            "crear": crear,
+            "estado": final,
+            "notificar": notificar,
+            "fecha_hora_mdf": cambios[-1][1],
+            "id_estado_turno": cambios[-1][2],
+            "eventos": len(cambios),
+        })
+    return transiciones
+
+
 def decode_res(res: Response) -> int:
     match res.status_code:
         case 503:
@@ -403,3 +601,10 @@ def create_flow(telefono: str, turno: Turno ) -> None:
         if ack < 0:
             turno.id_estado_paciente_id = ack
             turno.save(update_fields=["id_estado_paciente"])
+
+
+class SumarDias(Func):
+    """fecha + n días en SQL: SumarDias(Value(hoy), F('dias_antes'))."""
+    output_field = DateField()
+    template = "DATE_ADD(%(expressions)s DAY)"
+    arg_joiner = ", INTERVAL "
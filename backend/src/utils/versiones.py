@@ -0,0 +1,73 @@
+"""
+Contadores de versión en Redis para las cachés en memoria de cada proceso
+(catalogo, config_notif). Quien modifica los datos incrementa la versión y
+cada proceso, a lo sumo cada CACHE_VERSION_SEG segundos, la compara con la
+que tenía al cargar: así un cambio guardado en la API se ve en los workers de
+Celery sin esperar al TTL. Sin Redis se vuelve al vencimiento por TTL.
+"""
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+from .redis_client import get_redis
+
+PREFIJO = "notificaciones:version:"
+
+
+def actual(nombre: str) -> int | None:
+    try:
+        v = get_redis().get(PREFIJO + nombre)
+    except RedisError:
+        return None
+    return int(v) if v is not None else 0
+
+
+def incrementar(nombre: str) -> None:
+    try:
+        get_redis().incr(PREFIJO + nombre)
+    except RedisError as ex:
+        print(f"[WARN] no se pudo publicar la versión de {nombre}: {ex}")
+
+
+class CacheVersionada:
+    """
+    Datos de cargar() en memoria del proceso. Se recargan al vencer el TTL
+    (nombre de un setting, en segundos) o cuando cambia la versión nombre.
+    """
+
+    def __init__(self, nombre: str, cargar, ttl: str):
+        self.nombre = nombre
+        self.cargar = cargar
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._datos = None
+        self._vence = 0.0
+        self._revisar = 0.0
+        self._version = None
+
+    def datos(self):
+        datos = self._datos
+        ahora = time.monotonic()
+        if datos is not None and ahora < self._vence and ahora < self._revisar:
+            return datos
+        with self._lock:
+            ahora = time.monotonic()
+            vigente = self._datos is not None and ahora < self._vence
+            if vigente and ahora < self._revisar:
+                return self._datos
+            version = actual(self.nombre)
+            self._revisar = ahora + settings.CACHE_VERSION_SEG
+            if vigente and version == self._version:
+                return self._datos
+            self._datos = self.cargar()
+            self._vence = time.monotonic() + getattr(settings, self.ttl)
+            self._version = version
+            return self._datos
+
+    def invalidar(self) -> None:
+        """Descarta la caché en este proceso y, vía la versión en Redis, en los demás."""
+        with self._lock:
+            self._datos = None
+        # después del commit: otro proceso no debe recargar los datos viejos con la versión nueva
+        transaction.on_commit(lambda: incrementar(self.nombre))
@@ -24,8 +24,10 @@ from src.serializers import(PlantillaSerializer, EstadoMsjSerializer, EstadoTurn
                 EfeSerEspCompletoSerializer, TurnoEsperaCreateSerializer, TurnoEsperaCloseSerializer,
                 EstudioRequeridoSerializer )
 from typing import List
-from src.utils.utils import enviar_whatsapp, fetch_paciente, fetch_profesional
+from src.utils.utils import enviar_whatsapp, fetch_paciente, fetch_profesional, fetch_por_lotes
 from src.utils.querys_informix import query_turno_historico_paciente, query_turnos, query_eliminado
+from src.tasks import sincronizar_efectores
+from src.utils import limitador
 import logging
 logger = logging.getLogger(__name__)
 from django.shortcuts import render
@@ -146,6 +148,14 @@ class EfectorViewSet(viewsets.ModelViewSet):
     queryset = Efector.objects.all()
     serializer_class = EfectorSerializer
 
+    @action(detail=False, methods=["post"], url_path="sincronizar")
+    def sincronizar(self, request) -> Response:
+        # fuerza el refresco de la copia local de direcciones (todas o ?id=)
+        id_efector = request.query_params.get("id")
+        ids = [int(id_efector)] if id_efector else None
+        sincronizar_efectores.delay(ids)
+        return Response({"detail": "Sincronización encolada"}, status=status.HTTP_202_ACCEPTED)
+
 class ServicioViwSet(viewsets.ModelViewSet):
     queryset = Servicio.objects.all()
     serializer_class = ServicioSerializer
@@ -485,6 +495,15 @@ class SendWSP(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # sin token no se espera dentro del request: el cliente reintenta
+        espera = limitador.reservar(espera_max=0)
+        if espera < 0:
+            return Response(
+                {'error': 'Límite de envíos alcanzado, reintente más tarde'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(int(-espera) + 1)}
+            )
+
         return enviar_whatsapp(numero, msj)
 
 
@@ -648,7 +667,6 @@ class GetIncorrectoAPIView(APIView):
 
             qs = (
                 Turno.objects
-                .select_related("id_efe_ser_esp")
                 .annotate(
                     latest_msg_estado=Subquery(latest_msg_qs.values('id_estado')[:1]),
                 )
@@ -686,8 +704,7 @@ class GetIncorrectoAPIView(APIView):
             with connections['informix'].cursor() as cur:
 
                 # ejecutar sql1
-                cur.execute(query_turnos(len(ids_list)), ids_list)
-                rows = cur.fetchall()
+                rows = fetch_por_lotes(cur, query_turnos, ids_list).values()
                 for row in rows:
                     turno_id = str(row[0])
                     ext_map_asig[turno_id] = {
@@ -699,8 +716,7 @@ class GetIncorrectoAPIView(APIView):
                         'profesional_apellido': row[6],
                     }
                 
-                cur.execute(query_eliminado(len(ids_list)), ids_list)
-                rows = cur.fetchall()
+                rows = fetch_por_lotes(cur, query_eliminado, ids_list).values()
                 for row in rows:
                     turno_id = str(row[0])
                     ext_map_elim[turno_id] = {
@@ -784,7 +800,6 @@ class TurnosMergedAllAPIView(APIView):
         try:
             qs = (
                 Turno.objects
-                .select_related("id_efe_ser_esp")
                 .filter(**filters)
                 .order_by('-fecha', '-hora', '-id')
             )
@@ -813,8 +828,7 @@ class TurnosMergedAllAPIView(APIView):
         ext_map_elim = {}
         try:
             with connections['informix'].cursor() as cur:
-                cur.execute(query_turnos(len(ids_list)), ids_list)
-                rows = cur.fetchall()
+                rows = fetch_por_lotes(cur, query_turnos, ids_list).values()
                 for row in rows:
                     turno_id = str(row[0])
                     ext_map_asig[turno_id] = {
@@ -825,8 +839,7 @@ class TurnosMergedAllAPIView(APIView):
                         'profesional_nombre': row[5],
                         'profesional_apellido': row[6],
                     }
-                cur.execute(query_eliminado(len(ids_list)), ids_list)
-                rows = cur.fetchall()
+                rows = fetch_por_lotes(cur, query_eliminado, ids_list).values()
                 for row in rows:
                     turno_id = str(row[0])
                     ext_map_elim[turno_id] = {
@@ -910,7 +923,6 @@ class TurnosAlertasAPIView(APIView):
             try:
                 qs = (
                     Turno.objects
-                    .select_related("id_efe_ser_esp")
                     .filter(**filters)
                     .order_by('-fecha', '-hora', '-id')
                 )
@@ -951,8 +963,7 @@ class TurnosAlertasAPIView(APIView):
             try:
                 if ids_list:
                     with connections['informix'].cursor() as cur:
-                        cur.execute(query_turnos(len(ids_list)), ids_list)
-                        rows = cur.fetchall()
+                        rows = fetch_por_lotes(cur, query_turnos, ids_list).values()
                         for row in rows:
                             turno_id = str(row[0])
                             ext_map_asig[turno_id] = {
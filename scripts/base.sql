@@ -79,6 +79,8 @@ CREATE TABLE IF NOT EXISTS turno(
     id_efe_ser_esp INT NOT NULL,
     fecha DATE NOT NULL,
     hora TIME NOT NULL,
+    -- recordatorios: por configuración y fecha = hoy + dias_antes
+    KEY idx_turno_recordatorio (id_efe_ser_esp, fecha, id_estado, msj_recordatorio),
     FOREIGN KEY (id_estado) REFERENCES estado_turno(id),
     FOREIGN KEY (id_efe_ser_esp) REFERENCES efe_ser_esp(id),
     FOREIGN KEY (id_estado_paciente) REFERENCES estado_turno_paciente(id)
@@ -101,7 +103,10 @@ CREATE TABLE IF NOT EXISTS mensaje (
     id_plantilla INT NOT NULL,
     fecha_envio DATETIME NOT NULL,
     fecha_last_ack DATETIME NULL,
+    fecha_ultima_consulta DATETIME NULL,
+    fecha_callback DATETIME NULL,
     id_estado INT NOT NULL,
+    KEY idx_mensaje_estado_envio (id_estado, fecha_envio),
     FOREIGN KEY (id_turno) REFERENCES turno(id),
     FOREIGN KEY (id_sesion) REFERENCES sesion(id),
     FOREIGN KEY (id_estado) REFERENCES estado_msj(id),
@@ -242,4 +247,72 @@ CREATE TABLE IF NOT EXISTS deriva (
     cupo TINYINT NOT NULL,
     FOREIGN KEY (id_efector) REFERENCES efector(id),
     FOREIGN KEY (id_efe_ser_esp_deriva) REFERENCES efe_ser_esp(id)
-);
\ No newline at end of file
+);
+
+-- Eventos de turnoshistorico ya procesados por verificar_turnos (idempotencia)
+CREATE TABLE IF NOT EXISTS evento_procesado (
+    id INT AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    id_turno INT NOT NULL,
+    fecha_hora_mdf VARCHAR(26) NOT NULL,
+    id_estado_turno SMALLINT NOT NULL,
+    fecha_registro DATETIME NOT NULL,
+    UNIQUE KEY uq_evento (id_turno, fecha_hora_mdf, id_estado_turno),
+    KEY idx_evento_registro (fecha_registro)
+);
+
+
+-- Copia local de dirección y contacto de efectores (Informix), ver sincronizar_efectores
+CREATE TABLE IF NOT EXISTS efector_direccion (
+    id_efector INT NOT NULL PRIMARY KEY,
+    nombre VARCHAR(64) NULL,
+    calle VARCHAR(64) NULL,
+    altura VARCHAR(10) NULL,
+    letra VARCHAR(4) NULL,
+    coordx VARCHAR(32) NULL,
+    coordy VARCHAR(32) NULL,
+    telefono VARCHAR(32) NULL,
+    calle_nom VARCHAR(64) NULL,
+    fecha_sync DATETIME NOT NULL,
+    FOREIGN KEY (id_efector) REFERENCES efector(id)
+);
+
+
+-- Bandeja de salida (outbox) de avisos: se escribe en la misma transacción que
+-- el cambio de estado del turno y la despacha despachar_bandeja
+CREATE TABLE IF NOT EXISTS bandeja_salida (
+    id INT AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    id_turno INT NOT NULL,
+    id_plantilla INT NOT NULL,
+    tipo_aviso SMALLINT NOT NULL,
+    fecha_hora_mdf VARCHAR(26) NOT NULL,
+    id_estado_turno SMALLINT NOT NULL,
+    numero VARCHAR(16) NOT NULL,
+    texto TEXT NOT NULL,
+    estado SMALLINT NOT NULL DEFAULT 0,
+    intentos INT NOT NULL DEFAULT 0,
+    fecha_alta DATETIME NOT NULL,
+    fecha_proximo DATETIME NOT NULL,
+    fecha_envio DATETIME NULL,
+    UNIQUE KEY uq_bandeja_evento (id_turno, fecha_hora_mdf, id_estado_turno),
+    KEY idx_bandeja_pendientes (estado, fecha_proximo),
+    FOREIGN KEY (id_turno) REFERENCES turno(id),
+    FOREIGN KEY (id_plantilla) REFERENCES plantilla(id)
+);
+
+
+-- Envíos programados (recordatorios): los arma programar_recordatorios y los
+-- despacha despachar_programados cuando vence fecha_programada
+CREATE TABLE IF NOT EXISTS envio_programado (
+    id INT AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    id_turno INT NOT NULL,
+    tipo_aviso SMALLINT NOT NULL,
+    fecha_programada DATETIME NOT NULL,
+    estado SMALLINT NOT NULL DEFAULT 0,
+    intentos INT NOT NULL DEFAULT 0,
+    snapshot VARCHAR(64) NOT NULL,
+    fecha_alta DATETIME NOT NULL,
+    fecha_envio DATETIME NULL,
+    UNIQUE KEY uq_envio_programado (id_turno, tipo_aviso),
+    KEY idx_envio_programado_vence (estado, fecha_programada),
+    FOREIGN KEY (id_turno) REFERENCES turno(id)
+);